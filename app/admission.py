@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from . import metrics
+from .database import pool_capacity
+from .route_classes import ADMIN, ANALYTICS, INTERACTIVE_READ, ROUTE_CLASSES, WRITE, classify, env_name, in_memory
+
+# Настройки admission control из переменных окружения
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.9"))
+
+# Значения по умолчанию: начальный/минимальный лимит, целевая латентность (сек),
+# размер очереди ожидания и максимальное время ожидания в очереди (сек).
+# Максимальный лимит (бюджет конкурентности) по умолчанию равен емкости пула
+# соединений класса, чтобы запросы не ждали соединение внутри обработчика.
+ROUTE_CLASS_DEFAULTS = {
+    INTERACTIVE_READ: {"initial": 8, "min": 2, "target_latency": 0.1, "queue": 50, "queue_timeout": 0.5},
+    WRITE: {"initial": 8, "min": 2, "target_latency": 0.2, "queue": 50, "queue_timeout": 1.0},
+    ANALYTICS: {"initial": 2, "min": 1, "target_latency": 1.0, "queue": 10, "queue_timeout": 2.0},
+    ADMIN: {"initial": 4, "min": 1, "target_latency": 0.5, "queue": 10, "queue_timeout": 1.0},
+}
+
+
+def _setting(route_class: str, name: str):
+    if name == "max":
+        default = pool_capacity(route_class)
+    else:
+        default = ROUTE_CLASS_DEFAULTS[route_class][name]
+    return type(default)(os.getenv(f"ADMISSION_{env_name(route_class)}_{name.upper()}", default))
+
+
+class Shed(Exception):
+    """Запрос отклонен: лимит исчерпан и очередь заполнена или ожидание истекло"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdaptiveLimiter:
+    """AIMD лимит конкурентности с ограниченной очередью ожидания.
+
+    Пока латентность укладывается в цель, лимит растет на 1/limit за каждый
+    успешный запрос; при превышении цели или ошибке сервера лимит умножается
+    на ADMISSION_BACKOFF (не чаще одного раза за целевую латентность).
+    Работает внутри одного event loop, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, route_class: str, initial: int, min_limit: int, max_limit: int,
+                 target_latency: float, max_queue: int, queue_timeout: float):
+        self.route_class = route_class
+        self.limit = float(min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+        self._inflight_gauge = metrics.admission_inflight.labels(route_class=route_class)
+        self._queued_gauge = metrics.admission_queued.labels(route_class=route_class)
+        self._limit_gauge = metrics.admission_limit.labels(route_class=route_class)
+        self._limit_gauge.set(self.limit)
+        self._saturation_gauge = metrics.bulkhead_saturation.labels(route_class=route_class)
+        metrics.bulkhead_budget.labels(route_class=route_class).set(max_limit)
+
+    @classmethod
+    def from_env(cls, route_class: str) -> "AdaptiveLimiter":
+        return cls(
+            route_class,
+            initial=_setting(route_class, "initial"),
+            min_limit=_setting(route_class, "min"),
+            max_limit=_setting(route_class, "max"),
+            target_latency=_setting(route_class, "target_latency"),
+            max_queue=_setting(route_class, "queue"),
+            queue_timeout=_setting(route_class, "queue_timeout"),
+        )
+
+    async def acquire(self):
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            self._update_gauges()
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._shed("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queued_gauge.set(len(self._waiters))
+        try:
+            # Слот передается ожидающему напрямую в release(), inflight уже учтен
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот успели передать в момент таймаута - возвращаем его
+                self._release_slot()
+            self._shed("queue_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._queued_gauge.set(len(self._waiters))
+            if not waiter.done():
+                waiter.cancel()
+
+    def release(self, latency: float, failed: bool = False):
+        now = time.monotonic()
+        if failed or latency > self.target_latency:
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(self.min_limit, self.limit * ADMISSION_BACKOFF)
+                self._last_decrease = now
+        elif self.inflight * 2 >= self.limit:
+            # Растем только если лимит реально используется
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._limit_gauge.set(self.limit)
+        self._release_slot()
+
+    def _release_slot(self):
+        self.inflight -= 1
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.inflight += 1
+            waiter.set_result(None)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        self._queued_gauge.set(len(self._waiters))
+        self._inflight_gauge.set(self.inflight)
+        self._saturation_gauge.set(self.inflight / self.max_limit)
+
+    def _shed(self, reason: str):
+        metrics.admission_shed_total.labels(route_class=self.route_class, reason=reason).inc()
+        raise Shed(reason)
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware: адаптивные лимиты по классам маршрутов и быстрый 503 при перегрузке"""
+
+    def __init__(self, app):
+        self.app = app
+        self.limiters = {route_class: AdaptiveLimiter.from_env(route_class) for route_class in ROUTE_CLASSES}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or in_memory(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[classify(scope["method"], scope["path"])]
+        try:
+            await limiter.acquire()
+        except Shed:
+            await self._reject(send)
+            return
+
+        status = 500
+        start_time = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            limiter.release(time.perf_counter() - start_time, failed=status >= 500)
+
+    async def _reject(self, send):
+        body = b'{"detail":"Service overloaded, retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(ADMISSION_RETRY_AFTER).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
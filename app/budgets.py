@@ -0,0 +1,133 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from . import metrics
+
+# Бюджет запросов к БД на HTTP запрос: сколько SQL запросов выполнено и сколько
+# времени они заняли (считает queries.py). Маршрут объявляет бюджет декоратором
+# query_budget; превышение бюджета или повтор одного и того же запроса
+# QUERY_REPEAT_LIMIT раз (признак N+1) в режиме warn пишется в лог и метрику,
+# в режиме raise - прерывает запрос исключением на запросе-нарушителе.
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "warn").lower()
+if QUERY_BUDGET_MODE not in ("off", "warn", "raise"):
+    raise ValueError(f"Unsupported QUERY_BUDGET_MODE: {QUERY_BUDGET_MODE}")
+# Бюджет маршрутов без декоратора, пусто - без ограничения
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT") or -1)
+QUERY_REPEAT_LIMIT = int(os.getenv("QUERY_REPEAT_LIMIT", "5"))
+# X-DB-Queries и X-DB-Time (мс) в ответах
+QUERY_DEBUG_HEADERS = os.getenv("QUERY_DEBUG_HEADERS", "false").lower() == "true"
+# Ленивая загрузка relationship в models.py: в режиме raise по умолчанию запрещена,
+# чтобы N+1 через обращение к атрибуту падал сразу
+DB_RELATIONSHIP_LAZY = os.getenv("DB_RELATIONSHIP_LAZY", "raise" if QUERY_BUDGET_MODE == "raise" else "select")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries: int):
+    """Декоратор маршрута: сколько SQL запросов ему положено"""
+    def decorator(func):
+        func.query_budget = max_queries
+        return func
+    return decorator
+
+
+def _template(scope) -> str:
+    route = scope.get("route")
+    return route.path_format if route is not None else metrics.UNMATCHED_ENDPOINT
+
+
+class RequestQueries:
+    """SQL запросы одного HTTP запроса"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.repeats = {}
+        self.violations = []
+
+    def record(self, fingerprint: str, duration: float):
+        self.count += 1
+        self.seconds += duration
+        repeats = self.repeats[fingerprint] = self.repeats.get(fingerprint, 0) + 1
+        if QUERY_BUDGET_MODE == "off":
+            return
+        # Маршрут уже найден: первый запрос к БД выполняется в зависимостях или обработчике
+        budget = getattr(self.scope.get("endpoint"), "query_budget", QUERY_BUDGET_DEFAULT)
+        if budget >= 0 and self.count == budget + 1:
+            self._violate("budget", f"more than {budget} queries")
+        if QUERY_REPEAT_LIMIT and repeats == QUERY_REPEAT_LIMIT:
+            self._violate("repeat", f"statement {fingerprint} executed {repeats} times")
+
+    def _violate(self, kind: str, message: str):
+        template = _template(self.scope)
+        metrics.query_budget_violations_total.labels(endpoint=template, kind=kind).inc()
+        if QUERY_BUDGET_MODE == "raise":
+            raise QueryBudgetExceeded(f"{self.scope['method']} {template}: {message}")
+        self.violations.append(message)
+
+
+current_request: ContextVar[Optional[RequestQueries]] = ContextVar("current_request", default=None)
+
+
+@contextmanager
+def untracked():
+    """Запросы внутри блока не входят в счетчик HTTP запроса (служебные записи после ответа)"""
+    token = current_request.set(None)
+    try:
+        yield
+    finally:
+        current_request.reset(token)
+
+
+def current_route() -> Optional[str]:
+    """Метод и шаблон маршрута HTTP запроса, в котором выполняется код"""
+    request = current_request.get()
+    if request is None:
+        return None
+    return f"{request.scope['method']} {_template(request.scope)}"
+
+
+def record(fingerprint: str, duration: float):
+    """Вызывается из queries.py на каждый выполненный SQL запрос"""
+    request = current_request.get()
+    if request is not None:
+        request.record(fingerprint, duration)
+
+
+class QueryBudgetMiddleware:
+    """ASGI middleware: счетчик SQL запросов HTTP запроса, метрики и отладочные заголовки"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestQueries(scope)
+        token = current_request.set(request)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and QUERY_DEBUG_HEADERS:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-db-queries", str(request.count).encode("latin-1")),
+                    (b"x-db-time", f"{request.seconds * 1000:.2f}".encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            template = _template(scope)
+            method = scope["method"] if scope["method"] in metrics.HTTP_METHODS else "OTHER"
+            metrics.http_request_db_queries.labels(method=method, endpoint=template).observe(request.count)
+            metrics.http_request_db_seconds.labels(method=method, endpoint=template).observe(request.seconds)
+            if request.violations:
+                print(f"Query budget warning {method} {template}: {'; '.join(request.violations)}")
@@ -0,0 +1,241 @@
+import gzip
+import hashlib
+import os
+import zlib
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+# brotli и zstandard необязательны: если пакетов нет, остается только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Настройки сжатия из переменных окружения
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "86400"))
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/msgpack",
+    "application/openmetrics-text",
+)
+
+# Порядок предпочтения сервера при одинаковом q
+SUPPORTED_ENCODINGS = [name for name, module in (
+    ("br", brotli),
+    ("zstd", zstandard),
+    ("gzip", gzip),
+) if module is not None]
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        # SYNC_FLUSH отдает клиенту все, что накоплено, не дожидаясь конца потока
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def _make_encoder(encoding: str):
+    if encoding == "br":
+        return _BrotliEncoder(COMPRESSION_BROTLI_QUALITY)
+    if encoding == "zstd":
+        return _ZstdEncoder(COMPRESSION_ZSTD_LEVEL)
+    return _GzipEncoder(COMPRESSION_GZIP_LEVEL)
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """Сжимает буфер целиком; best=True - максимальная степень для статики"""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else COMPRESSION_BROTLI_QUALITY)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=19 if best else COMPRESSION_ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=9 if best else COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбирает кодировку по Accept-Encoding, None - отдавать без сжатия"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type or "+msgpack" in content_type
+
+
+class CompressionMiddleware:
+    """ASGI middleware: сжимает ответы по Accept-Encoding, в том числе потоковые"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if encoder is None:
+                headers = {name.lower(): value for name, value in start_message.get("headers", [])}
+                content_length = headers.get(b"content-length")
+                small = (
+                    content_length is not None and int(content_length) < self.minimum_size
+                ) or (not more_body and len(body) < self.minimum_size)
+                if (
+                    b"content-encoding" in headers
+                    or start_message["status"] in (204, 304)
+                    or not _is_compressible(headers.get(b"content-type", b"").decode("latin-1"))
+                    or small
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                encoder = _make_encoder(encoding)
+                raw_headers = [
+                    (name, value) for name, value in start_message.get("headers", [])
+                    if name.lower() != b"content-length"
+                ]
+                raw_headers.append((b"content-encoding", encoding.encode("latin-1")))
+                raw_headers.append((b"vary", b"Accept-Encoding"))
+
+                if not more_body:
+                    # Ответ целиком в одном сообщении - сжимаем и выставляем длину
+                    compressed = compress(body, encoding)
+                    raw_headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+                    start_message["headers"] = raw_headers
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+
+                start_message["headers"] = raw_headers
+                await send(start_message)
+
+            # Потоковый ответ: сжимаем по чанкам, без буферизации всего тела
+            chunk = encoder.compress(body) if body else b""
+            if not more_body:
+                chunk += encoder.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class StaticPage:
+    """Статическая страница, сжатая один раз при старте, с ETag для кеширования"""
+
+    def __init__(self, content: str, media_type: str = "text/html; charset=utf-8"):
+        body = content.encode("utf-8")
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants: Dict[Optional[str], bytes] = {None: body}
+        for encoding in SUPPORTED_ENCODINGS:
+            self.variants[encoding] = compress(body, encoding, best=True)
+
+    def _matches(self, if_none_match: str) -> bool:
+        # Любой вариант страницы (сжатый или нет) подтверждает актуальность кеша
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*" or tag.removeprefix("W/").strip('"').split("-")[0] == self.digest:
+                return True
+        return False
+
+    def response(self, request: Request) -> Response:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        headers = {
+            "ETag": f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"',
+            "Cache-Control": f"public, max-age={STATIC_MAX_AGE}",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and self._matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.variants[encoding], media_type=self.media_type, headers=headers)
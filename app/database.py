@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Request
 import os
+import time
+
+from . import metrics, pool, queries, replicas, route_classes
 
 # Настройки БД из переменных окружения
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
@@ -10,17 +14,151 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "learntracker")
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# Драйвер: psycopg2 (по умолчанию) или psycopg (psycopg 3 с серверными prepared statements)
+DB_DRIVER = os.getenv("DB_DRIVER", "psycopg2").lower()
+if DB_DRIVER not in ("psycopg2", "psycopg"):
+    raise ValueError(f"Unsupported DB_DRIVER: {DB_DRIVER}")
+# psycopg 3 готовит запрос на сервере после N выполнений на соединении (0 - сразу,
+# none - никогда, нужно за PgBouncer в режиме transaction)
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "2").lower()
+
+def database_url(host_port):
+    return f"postgresql+{DB_DRIVER}://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{host_port}/{POSTGRES_DB}"
+
+DATABASE_URL = database_url(f"{POSTGRES_HOST}:{POSTGRES_PORT}")
+
+def engine_options():
+    """Параметры create_engine для пулов primary и реплик"""
+    options = pool.engine_options()
+    if DB_DRIVER == "psycopg":
+        options["connect_args"] = {
+            "prepare_threshold": None if DB_PREPARE_THRESHOLD == "none" else int(DB_PREPARE_THRESHOLD),
+        }
+    return options
+
+# Размеры пулов (pool_size, max_overflow) по классам маршрутов.
+# Переопределяются через DB_POOL_<КЛАСС>_SIZE и DB_POOL_<КЛАСС>_MAX_OVERFLOW
+POOL_DEFAULTS = {
+    route_classes.INTERACTIVE_READ: (5, 5),
+    route_classes.WRITE: (5, 5),
+    route_classes.ANALYTICS: (2, 0),
+    route_classes.ADMIN: (2, 2),
+}
+
+def _pool_settings(route_class):
+    pool_size, max_overflow = POOL_DEFAULTS[route_class]
+    prefix = f"DB_POOL_{route_classes.env_name(route_class)}"
+    return (
+        int(os.getenv(f"{prefix}_SIZE", pool_size)),
+        int(os.getenv(f"{prefix}_MAX_OVERFLOW", max_overflow)),
+    )
+
+def pool_capacity(route_class):
+    """Максимум одновременных соединений в пуле класса"""
+    pool_size, max_overflow = _pool_settings(route_class)
+    return pool_size + max_overflow
+
+# Создание подключений: отдельный engine (и пул) на каждый класс маршрутов,
+# чтобы насыщение одного класса не блокировало остальные
+engines = {}
+for _route_class in route_classes.ROUTE_CLASSES:
+    _pool_size, _max_overflow = _pool_settings(_route_class)
+    engines[_route_class] = create_engine(
+        DATABASE_URL,
+        pool_size=_pool_size,
+        max_overflow=_max_overflow,
+        pool_logging_name=_route_class,
+        **engine_options(),
+    )
+    pool.instrument(engines[_route_class], _route_class)
+    queries.instrument(engines[_route_class])
+
+engine = engines[route_classes.WRITE]
+
+# Режим транзакций GET запросов:
+#   readonly   - транзакции READ ONLY (BEGIN READ ONLY вместо BEGIN, без лишних round trip);
+#   autocommit - без BEGIN/ROLLBACK, соединение возвращается в пул сразу после каждого запроса;
+#   off        - обычные транзакции, как у записей
+DB_READ_MODE = os.getenv("DB_READ_MODE", "readonly").lower()
 
-# Создание подключения
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_read_engines = {}
+
+def read_engine(bind):
+    """Engine с параметрами режима чтения поверх того же пула соединений"""
+    read_bind = _read_engines.get(bind)
+    if read_bind is None:
+        if DB_READ_MODE == "autocommit":
+            read_bind = bind.execution_options(isolation_level="AUTOCOMMIT")
+        else:
+            read_bind = bind.execution_options(postgresql_readonly=True)
+        _read_engines[bind] = read_bind
+    return read_bind
+
+# Реплики для чтения (POSTGRES_REPLICA_HOSTS)
+replica_router = replicas.build_router(database_url, _pool_settings, engine_options)
+
+class RoutingSession(Session):
+    """Сессия, которая читает с реплики из info["replica"], а пишет в primary"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing and not getattr(clause, "is_dml", False):
+            return replica
+        return super().get_bind(mapper, clause=clause, **kw)
+
+# expire_on_commit=False: INSERT ... RETURNING уже вернул id и серверные значения по умолчанию,
+# поэтому объекты после commit не перечитываются отдельной транзакцией
+SessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
 Base = declarative_base()
 
-# Dependency для получения сессии БД
-def get_db():
-    db = SessionLocal()
+@event.listens_for(SessionLocal, "after_commit")
+def _mark_client_write(session):
+    if not session.info.get("read_only"):
+        replica_router.mark_write(session.info.get("client_id"))
+
+@event.listens_for(SessionLocal, "after_begin")
+def _start_hold_timer(session, transaction, connection):
+    session.info["hold_started"] = time.perf_counter()
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _stop_hold_timer(session, transaction):
+    started = session.info.pop("hold_started", None)
+    if started is not None and transaction.parent is None:
+        session.info["hold_time"] = session.info.get("hold_time", 0.0) + time.perf_counter() - started
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _release_after_read(orm_execute_state):
+    # В режиме autocommit результат чтения буферизуется целиком, а соединение
+    # сразу возвращается в пул: commit() здесь не ходит в БД и не сбрасывает объекты
+    session = orm_execute_state.session
+    if DB_READ_MODE != "autocommit" or not session.info.get("read_only"):
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    session.commit()
+    return frozen()
+
+def client_id(request: Request):
+    """Идентификатор клиента для read-your-writes: X-Client-Id или адрес"""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else None)
+
+# Dependency для получения сессии БД из пула класса текущего маршрута.
+# Соединение берется из пула только при первом запросе к БД.
+def get_db(request: Request):
+    route_class = route_classes.classify(request.method, request.url.path)
+    read_only = request.method in ("GET", "HEAD") and DB_READ_MODE != "off"
+    bind = engines[route_class]
+    db = SessionLocal(bind=read_engine(bind) if read_only else bind)
+    db.info["client_id"] = client_id(request)
+    replica = replica_router.choose(route_class, db.info["client_id"])
+    db.info["replica"] = read_engine(replica) if read_only and replica is not None else replica
+    if read_only:
+        db.info["read_only"] = True
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        hold_time = db.info.get("hold_time")
+        if hold_time is not None:
+            metrics.db_request_connection_hold_seconds.labels(route_class=route_class).observe(hold_time)
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import Pool
+
+from . import metrics, queries, route_classes
+from .database import DB_READ_MODE, SessionLocal
+
+# Дедлайны запросов: время на запрос берется из заголовка X-Request-Timeout (мс)
+# или из значения по умолчанию для класса маршрута. Остаток времени выставляется
+# как statement_timeout/lock_timeout транзакции, а при отключении клиента
+# выполняющийся запрос отменяется на стороне Postgres.
+DEADLINE_HEADER = b"x-request-timeout"
+DEADLINE_MAX_MS = int(os.getenv("DEADLINE_MAX_MS", "30000"))
+DEADLINE_MIN_MS = int(os.getenv("DEADLINE_MIN_MS", "10"))
+
+DEADLINE_DEFAULTS_MS = {
+    route_classes.INTERACTIVE_READ: 2000,
+    route_classes.WRITE: 5000,
+    route_classes.ANALYTICS: 10000,
+    route_classes.ADMIN: 5000,
+}
+
+# Аналог SET LOCAL statement_timeout/lock_timeout одним запросом с параметрами:
+# несколько команд в одной строке нельзя выполнить через extended protocol psycopg 3
+SET_DEADLINE_SQL = text(
+    "SELECT set_config('statement_timeout', :timeout, true), set_config('lock_timeout', :timeout, true)"
+)
+
+# SQLSTATE отмены запроса (statement_timeout, pg_cancel_backend) и lock_timeout
+QUERY_CANCELED = "57014"
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def default_timeout_ms(route_class: str) -> int:
+    return int(os.getenv(f"DEADLINE_{route_classes.env_name(route_class)}_MS", DEADLINE_DEFAULTS_MS[route_class]))
+
+
+class RequestDeadline:
+    """Дедлайн запроса и DBAPI соединения, которые сейчас работают на него"""
+
+    def __init__(self, route_class: str, timeout_ms: int):
+        self.route_class = route_class
+        self.timeout_ms = timeout_ms
+        self.expires_at = time.monotonic() + timeout_ms / 1000
+        self.disconnected = False
+        self.expired = False
+        # DBAPI соединение -> есть ли на нем statement_timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def remaining_ms(self) -> int:
+        return int((self.expires_at - time.monotonic()) * 1000)
+
+    def attach(self, dbapi_connection, guarded: bool = True):
+        """guarded=False - на соединении нет statement_timeout, отменяем по таймеру"""
+        with self._lock:
+            self._connections[dbapi_connection] = guarded
+
+    def detach(self, dbapi_connection):
+        # Ждет отмену, которая идет на этом соединении: соединение не вернется
+        # в пул и не достанется другому запросу, пока отмена не закончится
+        with self._lock:
+            self._connections.pop(dbapi_connection, None)
+
+    def expire(self):
+        """Срабатывает по таймеру в event loop: отменяет запросы без statement_timeout"""
+        self.expired = True
+        with self._lock:
+            connections = [c for c, guarded in self._connections.items() if not guarded]
+        if connections:
+            self.cancel_queries_in_background(connections)
+
+    def cancel_queries_in_background(self, connections=None):
+        """cancel() открывает новое соединение к Postgres, поэтому выполняется не в event loop"""
+        asyncio.get_running_loop().run_in_executor(None, self.cancel_queries, connections)
+
+    def cancel_queries(self, connections=None) -> int:
+        """Отменяет выполняющиеся запросы (cancel request по отдельному сокету)"""
+        with self._lock:
+            if connections is None:
+                connections = list(self._connections)
+        cancelled = 0
+        for dbapi_connection in connections:
+            with self._lock:
+                # Соединение уже вернулось в пул - его запрос может быть чужим
+                if dbapi_connection not in self._connections:
+                    continue
+                try:
+                    dbapi_connection.cancel()
+                    cancelled += 1
+                except Exception as e:
+                    print(f"Error cancelling query: {e}")
+        return cancelled
+
+
+current_deadline: ContextVar[Optional[RequestDeadline]] = ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@event.listens_for(SessionLocal, "after_begin")
+def _apply_deadline(session, transaction, connection):
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    remaining = deadline.remaining_ms()
+    if remaining < DEADLINE_MIN_MS:
+        metrics.requests_abandoned_total.labels(route_class=deadline.route_class, reason="deadline").inc()
+        raise DeadlineExceeded(f"Request deadline of {deadline.timeout_ms} ms exceeded")
+    if DB_READ_MODE == "autocommit" and session.info.get("read_only"):
+        # Без транзакции SET LOCAL не действует: такие запросы отменяются таймером дедлайна
+        _attach(deadline, connection, guarded=False)
+        return
+    # Действует до конца транзакции, оба параметра в одном round trip
+    connection.execute(SET_DEADLINE_SQL, {"timeout": str(remaining)})
+    _attach(deadline, connection)
+
+
+def _attach(deadline: RequestDeadline, connection, guarded: bool = True):
+    dbapi_connection = connection.connection.dbapi_connection
+    # info записи пула: по ней соединение открепляется при возврате в пул
+    connection.connection.info["deadline"] = (deadline, dbapi_connection)
+    deadline.attach(dbapi_connection, guarded)
+
+
+@event.listens_for(Pool, "checkin")
+def _release_deadline(dbapi_connection, connection_record):
+    # checkin приходит до возврата соединения в пул (after_transaction_end - уже после)
+    attached = connection_record.info.pop("deadline", None)
+    if attached is not None:
+        deadline, attached_connection = attached
+        deadline.detach(attached_connection)
+
+
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+async def operational_error_handler(request: Request, exc: OperationalError):
+    """Переводит отмену запроса по дедлайну или отключению клиента в 504"""
+    sqlstate = queries.sqlstate(exc.orig)
+    if sqlstate not in (QUERY_CANCELED, LOCK_NOT_AVAILABLE):
+        raise exc
+    deadline = current_deadline.get()
+    if deadline is not None and not deadline.disconnected:
+        metrics.requests_abandoned_total.labels(route_class=deadline.route_class, reason="deadline").inc()
+    return JSONResponse(status_code=504, content={"detail": "Request deadline exceeded"})
+
+
+def _parse_timeout_ms(scope) -> Optional[int]:
+    for name, value in scope["headers"]:
+        if name == DEADLINE_HEADER:
+            try:
+                return int(float(value))
+            except (ValueError, OverflowError):
+                # Нечисловое значение, inf и nan - как без заголовка
+                return None
+    return None
+
+
+class DeadlineMiddleware:
+    """ASGI middleware: дедлайн запроса и отмена запросов в БД при отключении клиента"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Маршрутам без БД нечего отменять: без задачи-насоса и таймера
+        if scope["type"] != "http" or route_classes.in_memory(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        route_class = route_classes.classify(scope["method"], scope["path"])
+        timeout_ms = _parse_timeout_ms(scope) or default_timeout_ms(route_class)
+        deadline = RequestDeadline(route_class, max(DEADLINE_MIN_MS, min(timeout_ms, DEADLINE_MAX_MS)))
+        token = current_deadline.set(deadline)
+
+        # Все сообщения клиента читает отдельная задача: так disconnect замечается,
+        # даже пока обработчик ждет ответа от БД в пуле потоков
+        messages = asyncio.Queue()
+
+        async def pump():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    deadline.disconnected = True
+                    if not response_complete:
+                        metrics.requests_abandoned_total.labels(
+                            route_class=route_class, reason="client_disconnect"
+                        ).inc()
+                        deadline.cancel_queries_in_background()
+                    return
+
+        response_complete = False
+
+        async def receive_wrapper():
+            if deadline.disconnected and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def send_wrapper(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        pump_task = asyncio.create_task(pump())
+        timer = asyncio.get_running_loop().call_later(deadline.timeout_ms / 1000, deadline.expire)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            response_complete = True
+            timer.cancel()
+            pump_task.cancel()
+            current_deadline.reset(token)
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from . import metrics, queries, route_classes
+from .database import SessionLocal, engines, replica_router
+
+# Group commit: записи, пришедшие почти одновременно, выполняются одной
+# транзакцией с одним commit (одним сбросом WAL). Ошибка одной записи не
+# откатывает остальные: такая пачка повторяется с SAVEPOINT на каждую запись.
+# Ответ клиенту отправляется только после commit - гарантии сохранности те же,
+# что и при отдельном commit на запрос.
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() == "true"
+# Сколько ждать следующих записей после первой (мс). 0 - в пачку попадает только
+# то, что накопилось в очереди, пока выполнялся предыдущий commit
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Фоновый поток, который выполняет записи пачками в общей транзакции"""
+
+    def __init__(self, window: float = GROUP_COMMIT_WINDOW_MS / 1000, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def submit_nowait(self, fn, *args, client_id=None) -> Future:
+        """Ставит запись fn(db, *args) в очередь; fn не должна вызывать commit"""
+        future = Future()
+        self._queue.put((fn, args, client_id, future, time.perf_counter()))
+        metrics.group_commit_queued.set(self._queue.qsize())
+        return future
+
+    async def submit(self, fn, *args, client_id=None):
+        """Результат fn после commit пачки или ее исключение"""
+        return await asyncio.wrap_future(self.submit_nowait(fn, *args, client_id=client_id))
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.perf_counter()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        metrics.group_commit_queued.set(self._queue.qsize())
+        return batch
+
+    def _execute(self, batch, savepoints: bool) -> list:
+        """Выполняет пачку и делает commit; возвращает (результат, ошибка) по записям"""
+        outcomes = []
+        db = SessionLocal(bind=engines[route_classes.WRITE])
+        try:
+            for fn, args, _, _, _ in batch:
+                if not savepoints:
+                    outcomes.append((fn(db, *args), None))
+                    continue
+                try:
+                    with db.begin_nested():
+                        result = fn(db, *args)
+                        db.flush()
+                    outcomes.append((result, None))
+                except Exception as e:
+                    # SAVEPOINT откатан, остальные записи пачки остаются
+                    outcomes.append((None, e))
+            db.commit()
+        finally:
+            db.close()
+        return outcomes
+
+    def _run_batch(self, batch):
+        start_time = time.perf_counter()
+        try:
+            # Обычно ошибок нет: пачка идет без SAVEPOINT, INSERT отправляются одним
+            # flush при commit. Если что-то упало, пачка повторяется с SAVEPOINT на
+            # каждую запись, чтобы ошибка досталась только своему запросу
+            try:
+                outcomes = self._execute(batch, savepoints=False)
+            except Exception:
+                outcomes = self._execute(batch, savepoints=True)
+        except Exception as e:
+            for _, _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        now = time.perf_counter()
+        metrics.group_commit_batch_size.observe(len(batch))
+        metrics.group_commit_duration_seconds.observe(now - start_time)
+        for (_, _, client_id, future, enqueued_at), (result, error) in zip(batch, outcomes):
+            metrics.group_commit_wait_seconds.observe(now - enqueued_at)
+            if error is not None:
+                future.set_exception(error)
+                continue
+            replica_router.mark_write(client_id)
+            future.set_result(result)
+
+    def _run(self):
+        # Запросы потока в метриках БД - operation="group_commit"
+        queries.current_operation.set("group_commit")
+        while True:
+            batch = self._collect(self._queue.get())
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Дописывает уже поставленные в очередь записи и останавливает поток"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+
+writer = GroupCommitWriter()
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics, models, queries, route_classes
+from .database import SessionLocal, engines
+
+# Heartbeat времени на уроке: клиент часто присылает, сколько секунд прошло
+# с предыдущего heartbeat. Секунды суммируются в памяти по паре студент-урок и
+# раз в HEARTBEAT_FLUSH_INTERVAL прибавляются к lesson_time одним upsert, поэтому
+# число запросов к БД зависит от числа активных пар, а не от частоты heartbeat.
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "5.0"))
+# Больше секунд в одном heartbeat не засчитывается (клиент "спал" или врет)
+HEARTBEAT_MAX_SECONDS = int(os.getenv("HEARTBEAT_MAX_SECONDS", "300"))
+HEARTBEAT_MAX_KEYS = int(os.getenv("HEARTBEAT_MAX_KEYS", "100000"))
+
+_lesson_time = models.LessonTime.__table__
+
+UPSERT_SQL = insert(_lesson_time)
+UPSERT_SQL = UPSERT_SQL.on_conflict_do_update(
+    index_elements=[_lesson_time.c.student_id, _lesson_time.c.lesson_id],
+    set_={"seconds": _lesson_time.c.seconds + UPSERT_SQL.excluded.seconds, "updated_at": func.now()},
+)
+
+# Потеря последних транзакций при падении Postgres для счетчика времени
+# допустима, а commit не ждет сброса WAL на диск
+SYNCHRONOUS_COMMIT_OFF_SQL = text("SET LOCAL synchronous_commit TO OFF")
+
+
+class HeartbeatAggregator:
+    """Суммы секунд по (student_id, lesson_id) и поток, который пишет их в lesson_time"""
+
+    def __init__(self, flush_interval: float = HEARTBEAT_FLUSH_INTERVAL, max_keys: int = HEARTBEAT_MAX_KEYS):
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Считается при сборе метрик, heartbeat не трогает gauge
+        metrics.heartbeat_pending_keys.set_function(lambda: len(self._totals))
+
+    def add(self, student_id: int, lesson_id: int, seconds: int) -> bool:
+        """Прибавляет секунды к паре; False - слишком много пар ждут записи"""
+        key = (student_id, lesson_id)
+        seconds = min(seconds, HEARTBEAT_MAX_SECONDS)
+        with self._lock:
+            total = self._totals.get(key)
+            if total is None:
+                if len(self._totals) >= self.max_keys:
+                    metrics.heartbeat_dropped_total.labels(reason="too_many_pending").inc()
+                    return False
+                total = 0
+            self._totals[key] = total + seconds
+        metrics.heartbeats_total.inc()
+        return True
+
+    def _take(self) -> dict:
+        with self._lock:
+            totals, self._totals = self._totals, {}
+        return totals
+
+    def _merge(self, totals: dict):
+        # Запись не удалась: возвращаем суммы, следующий сброс попробует снова
+        with self._lock:
+            for key, seconds in totals.items():
+                self._totals[key] = self._totals.get(key, 0) + seconds
+
+    def flush(self, retry: bool = True):
+        totals = self._take()
+        if not totals:
+            return
+        start_time = time.perf_counter()
+        # Одинаковый порядок строк у всех процессов - upsert не взаимоблокируются
+        rows = [
+            {"student_id": student_id, "lesson_id": lesson_id, "seconds": seconds}
+            for (student_id, lesson_id), seconds in sorted(totals.items())
+        ]
+        db = SessionLocal(bind=engines[route_classes.WRITE])
+        rejected = 0
+        try:
+            try:
+                db.execute(SYNCHRONOUS_COMMIT_OFF_SQL)
+                db.execute(UPSERT_SQL, rows)
+                db.commit()
+            except IntegrityError:
+                # Несуществующий студент или урок: повторяем построчно
+                db.rollback()
+                db.execute(SYNCHRONOUS_COMMIT_OFF_SQL)
+                for row in rows:
+                    try:
+                        with db.begin_nested():
+                            db.execute(UPSERT_SQL, row)
+                    except IntegrityError:
+                        rejected += 1
+                db.commit()
+        except Exception as e:
+            print(f"Heartbeat flush of {len(rows)} rows into lesson_time failed: {e}")
+            if retry:
+                self._merge(totals)
+            else:
+                metrics.heartbeat_dropped_total.labels(reason="flush_error").inc(len(rows))
+            return
+        finally:
+            db.close()
+        if rejected:
+            metrics.heartbeat_dropped_total.labels(reason="rejected").inc(rejected)
+        metrics.heartbeat_flush_seconds.observe(time.perf_counter() - start_time)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def run():
+            queries.current_operation.set("heartbeat_flush")
+            while not self._stop.wait(self.flush_interval):
+                self.flush()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="heartbeat-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток и записывает накопленное время"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        with queries.operation("heartbeat_flush"):
+            self.flush(retry=False)
+
+
+aggregator = HeartbeatAggregator()
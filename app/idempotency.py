@@ -0,0 +1,325 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import and_, bindparam, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+
+from . import budgets, metrics, models, queries, route_classes
+from .database import engines
+
+# Idempotency-Key для POST: первый ответ на ключ сохраняется (в памяти процесса и
+# в таблице idempotency_keys) и отдается повторным запросам с тем же ключом без
+# выполнения записи. Ключ резервируется в БД до выполнения запроса, поэтому
+# повтор, пришедший в другой процесс во время выполнения, получает 409, а не
+# вторую запись. Одновременные повторы в одном процессе ждут первый запрос.
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Через сколько секунд незавершенный ключ (процесс упал) можно выполнить заново
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+IDEMPOTENCY_MEMORY_MAX = int(os.getenv("IDEMPOTENCY_MEMORY_MAX", "10000"))
+IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", "300"))
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+MAX_KEY_LENGTH = 255
+
+_keys = models.IdempotencyKey.__table__
+
+# Новый ключ, истекший ключ или брошенный упавшим процессом - резервируем;
+# иначе RETURNING пуст и ответ нужно искать в таблице
+_reserve = insert(_keys)
+RESERVE_SQL = _reserve.on_conflict_do_update(
+    index_elements=[_keys.c.key],
+    set_={
+        "request_hash": _reserve.excluded.request_hash,
+        "status_code": None,
+        "headers": None,
+        "body": None,
+        "locked_until": _reserve.excluded.locked_until,
+        "expires_at": _reserve.excluded.expires_at,
+    },
+    where=or_(
+        _keys.c.expires_at < func.now(),
+        and_(_keys.c.status_code.is_(None), _keys.c.locked_until < func.now()),
+    ),
+).returning(_keys.c.key)
+
+LOOKUP_SQL = select(_keys.c.request_hash, _keys.c.status_code, _keys.c.headers, _keys.c.body).where(
+    _keys.c.key == bindparam("idempotency_key")
+)
+
+COMPLETE_SQL = update(_keys).where(_keys.c.key == bindparam("idempotency_key"))
+
+RELEASE_SQL = delete(_keys).where(_keys.c.key == bindparam("idempotency_key"), _keys.c.status_code.is_(None))
+
+CLEANUP_SQL = delete(_keys).where(_keys.c.expires_at < func.now())
+
+class InProgress:
+    """Ключ зарезервирован другим запросом, ответа еще нет"""
+
+    def __init__(self, request_hash: Optional[str]):
+        # None - резерв успели снять между вставкой и чтением
+        self.request_hash = request_hash
+
+
+class StoredResponse:
+    """Сохраненный ответ на ключ"""
+
+    def __init__(self, request_hash: str, status_code: int, headers: list, body: bytes):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.expires_at = time.monotonic() + IDEMPOTENCY_TTL
+
+    def encoded_headers(self) -> str:
+        return json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in self.headers])
+
+    @classmethod
+    def from_row(cls, row) -> "StoredResponse":
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row.headers)]
+        return cls(row.request_hash, row.status_code, headers, row.body)
+
+
+def reserve(key: str, request_hash: str):
+    """True - ключ наш, StoredResponse - ответ уже есть, InProgress - выполняется в другом месте"""
+    now = datetime.now(timezone.utc)
+    with queries.operation("idempotency_reserve"), engines[route_classes.WRITE].begin() as connection:
+        reserved = connection.execute(RESERVE_SQL, {
+            "key": key,
+            "request_hash": request_hash,
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT),
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL),
+        }).first()
+        if reserved is not None:
+            return True
+        row = connection.execute(LOOKUP_SQL, {"idempotency_key": key}).first()
+    if row is None or row.status_code is None:
+        return InProgress(row.request_hash if row is not None else None)
+    return StoredResponse.from_row(row)
+
+
+def complete(key: str, stored: StoredResponse):
+    with queries.operation("idempotency_complete"), engines[route_classes.WRITE].begin() as connection:
+        connection.execute(COMPLETE_SQL, {
+            "idempotency_key": key,
+            "status_code": stored.status_code,
+            "headers": stored.encoded_headers(),
+            "body": stored.body,
+        })
+
+
+def release(key: str):
+    """Снимает резерв, если ответ не сохранен (ошибка сервера): повтор выполнится заново"""
+    with queries.operation("idempotency_release"), engines[route_classes.WRITE].begin() as connection:
+        connection.execute(RELEASE_SQL, {"idempotency_key": key})
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for header, value in scope["headers"]:
+        if header == name:
+            return value
+    return None
+
+
+async def _send_response(send, status: int, headers: list, body: bytes):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_error(send, status: int, detail: str, retry_after: Optional[int] = None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode("latin-1")))
+    await _send_response(send, status, headers, body)
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware: повтор POST с тем же Idempotency-Key получает сохраненный ответ"""
+
+    def __init__(self, app):
+        self.app = app
+        self._memory = OrderedDict()
+        self._inflight = {}
+
+    def _remembered(self, key: str) -> Optional[StoredResponse]:
+        stored = self._memory.get(key)
+        if stored is None:
+            return None
+        if stored.expires_at < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return stored
+
+    def _remember(self, key: str, stored: StoredResponse):
+        self._memory[key] = stored
+        self._memory.move_to_end(key)
+        while len(self._memory) > IDEMPOTENCY_MEMORY_MAX:
+            self._memory.popitem(last=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        key = _header(scope, IDEMPOTENCY_HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        key = key.decode("latin-1").strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_error(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+            return
+
+        # Тело нужно целиком: повтор с тем же ключом, но другим запросом - ошибка клиента
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        request_hash = hashlib.sha256(scope["path"].encode() + b"\n" + body).hexdigest()
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def replay(stored: StoredResponse, outcome: str):
+            if stored.request_hash != request_hash:
+                metrics.idempotency_requests_total.labels(outcome="mismatch").inc()
+                await _send_error(send, 422, "Idempotency-Key was already used with a different request")
+                return
+            metrics.idempotency_requests_total.labels(outcome=outcome).inc()
+            await _send_response(send, stored.status_code, stored.headers + [REPLAYED_HEADER], stored.body)
+
+        # Одновременные запросы с одним ключом в этом процессе ждут первый
+        coalesced = False
+        while True:
+            stored = self._remembered(key)
+            if stored is not None:
+                await replay(stored, "coalesced" if coalesced else "replay_memory")
+                return
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            coalesced = True
+            await asyncio.shield(inflight)
+
+        inflight = asyncio.get_running_loop().create_future()
+        self._inflight[key] = inflight
+        try:
+            reserved = await run_in_threadpool(reserve, key, request_hash)
+            if isinstance(reserved, InProgress):
+                # Другой запрос с тем же ключом - ошибка клиента, ждать его бессмысленно
+                if reserved.request_hash is not None and reserved.request_hash != request_hash:
+                    metrics.idempotency_requests_total.labels(outcome="mismatch").inc()
+                    await _send_error(send, 422, "Idempotency-Key was already used with a different request")
+                    return
+                metrics.idempotency_requests_total.labels(outcome="in_progress").inc()
+                await _send_error(send, 409, "A request with this Idempotency-Key is in progress", retry_after=1)
+                return
+            if isinstance(reserved, StoredResponse):
+                self._remember(key, reserved)
+                await replay(reserved, "replay_db")
+                return
+
+            metrics.idempotency_requests_total.labels(outcome="new").inc()
+            await self._execute(scope, replay_receive, send, key, request_hash)
+        finally:
+            del self._inflight[key]
+            inflight.set_result(None)
+
+    async def _execute(self, scope, receive, send, key: str, request_hash: str):
+        status = 500
+        headers = []
+        chunks = []
+
+        async def send_wrapper(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            await self._release(key)
+            raise
+
+        # Ошибки сервера не сохраняются: повтор с тем же ключом выполнится заново
+        if status >= 500:
+            await self._release(key)
+            return
+        stored = StoredResponse(request_hash, status, headers, b"".join(chunks))
+        self._remember(key, stored)
+        try:
+            with budgets.untracked():
+                await run_in_threadpool(complete, key, stored)
+        except Exception as e:
+            # Ответ уже отправлен; другие процессы получат 409 до IDEMPOTENCY_LOCK_TIMEOUT
+            print(f"Error saving idempotent response: {e}")
+
+    async def _release(self, key: str):
+        try:
+            with budgets.untracked():
+                await run_in_threadpool(release, key)
+        except Exception as e:
+            print(f"Error releasing idempotency key: {e}")
+
+
+class ExpiredKeysCleanup:
+    """Фоновое удаление истекших ключей из idempotency_keys"""
+
+    def __init__(self, interval: float = IDEMPOTENCY_CLEANUP_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        try:
+            with engines[route_classes.WRITE].begin() as connection:
+                connection.execute(CLEANUP_SQL)
+        except Exception as e:
+            print(f"Idempotency keys cleanup failed: {e}")
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def run():
+            queries.current_operation.set("idempotency_cleanup")
+            while not self._stop.wait(self.interval):
+                self.run_once()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="idempotency-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+
+cleanup = ExpiredKeysCleanup()
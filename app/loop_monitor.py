@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+
+from . import metrics
+
+# Задержка event loop: фоновая задача засыпает на LOOP_MONITOR_INTERVAL и меряет,
+# насколько позже проснулась. Синхронный вызов (запрос к БД, time.sleep) в
+# async маршруте задерживает все запросы процесса. Если loop не отвечает дольше
+# LOOP_BLOCK_THRESHOLD_MS, сторожевой поток снимает стек loop потока - там видно
+# блокирующий код и маршрут, в котором он выполняется.
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_BLOCK_HISTORY = int(os.getenv("LOOP_BLOCK_HISTORY", "50"))
+
+UNKNOWN_ENDPOINT = "unknown"
+_STACK_LIMIT = 40
+
+
+def frame_endpoint(frame) -> str:
+    """Маршрут запроса по scope в кадрах ASGI middleware выше блокирующего кода"""
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and scope.get("type") == "http":
+            route = scope.get("route")
+            template = getattr(route, "path_format", None)
+            if template is not None:
+                return template
+            return metrics.UNMATCHED_ENDPOINT
+        frame = frame.f_back
+    return UNKNOWN_ENDPOINT
+
+
+class LoopMonitor:
+    """Задача, измеряющая задержку loop, и сторожевой поток, который ловит блокировки"""
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self._blocks = deque(maxlen=LOOP_BLOCK_HISTORY)
+        self._beat = time.monotonic()
+        self._captured = None
+        self._lock = threading.Lock()
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self._beat = time.monotonic()
+            metrics.event_loop_lag_seconds.observe(lag)
+            if lag >= self.threshold:
+                self._record_block(lag)
+
+    def _record_block(self, lag: float):
+        with self._lock:
+            captured, self._captured = self._captured, None
+        # Короткую блокировку сторож может не застать - маршрут неизвестен
+        endpoint, stack = captured if captured is not None else (UNKNOWN_ENDPOINT, None)
+        metrics.event_loop_blocked_seconds_total.labels(endpoint=endpoint).inc(lag)
+        metrics.event_loop_blocks_total.labels(endpoint=endpoint).inc()
+        self._blocks.append({
+            "time": datetime.now(timezone.utc).isoformat(),
+            "blocked_ms": round(lag * 1000, 1),
+            "endpoint": endpoint,
+            "stack": stack,
+        })
+        if stack is not None:
+            print(f"Event loop blocked for {lag * 1000:.0f} ms in {endpoint}:\n{''.join(stack[-5:])}")
+
+    def _watch(self):
+        # Проверяем чаще порога, чтобы застать блокировку, пока она длится
+        blocked_since = None
+        while not self._stop.wait(self.threshold / 4):
+            stalled = time.monotonic() - self._beat
+            if stalled < self.interval + self.threshold:
+                blocked_since = None
+                continue
+            if blocked_since == self._beat:
+                continue
+            blocked_since = self._beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_list(traceback.extract_stack(frame, limit=_STACK_LIMIT))
+            with self._lock:
+                self._captured = (frame_endpoint(frame), stack)
+            del frame
+
+    def blocks(self, limit: int) -> list:
+        """Последние блокировки, новые первыми"""
+        blocks = list(self._blocks)
+        blocks.reverse()
+        return blocks[:limit]
+
+    def start(self):
+        """Вызывается в потоке event loop (startup)"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+monitor = LoopMonitor()
@@ -1,12 +1,13 @@
 from fastapi import FastAPI, Depends, HTTPException, Request, Response
-from fastapi.responses import HTMLResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import OperationalError
 from typing import List
 import time
 import uvicorn
 
-from . import crud, models, schemas, metrics
-from .database import SessionLocal, engine, get_db
+from . import crud, models, reads, schemas, metrics, serialization, compression, admission, deadlines, group_commit, write_behind, heartbeats, idempotency, budgets, admin, slow_queries, server_timing, tracing, slo, loop_monitor, profiler, runtime
+from .database import SessionLocal, engine, get_db, replica_router
 
 # Создаем таблицы в БД
 models.Base.metadata.create_all(bind=engine)
@@ -17,31 +18,40 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Middleware для мониторинга всех запросов
-@app.middleware("http")
-async def monitor_requests_middleware(request: Request, call_next):
-    start_time = time.time()
-    
-    response = await call_next(request)
-    
-    # Записываем метрики
-    duration = time.time() - start_time
-    endpoint = request.url.path
-    method = request.method
-    status = str(response.status_code)
-    
-    metrics.http_requests_total.labels(
-        method=method, 
-        endpoint=endpoint, 
-        status=status
-    ).inc()
-    
-    metrics.http_request_duration.labels(
-        method=method, 
-        endpoint=endpoint
-    ).observe(duration)
-    
-    return response
+# Повторы POST с Idempotency-Key получают сохраненный ответ (до сжатия, ближе всего к приложению)
+if idempotency.IDEMPOTENCY_ENABLED:
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+
+# Сжатие ответов по Accept-Encoding
+if compression.COMPRESSION_ENABLED:
+    app.add_middleware(compression.CompressionMiddleware, minimum_size=compression.COMPRESSION_MIN_SIZE)
+
+# Адаптивные лимиты конкурентности и сброс нагрузки (503 + Retry-After)
+if admission.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionControlMiddleware)
+
+# Дедлайны запросов (statement_timeout) и отмена запросов в БД при отключении клиента
+app.add_middleware(deadlines.DeadlineMiddleware)
+app.add_exception_handler(deadlines.DeadlineExceeded, deadlines.deadline_exceeded_handler)
+app.add_exception_handler(OperationalError, deadlines.operational_error_handler)
+
+# Server-Timing с разбивкой времени ответа (внутри QueryBudgetMiddleware: берет из него время SQL)
+if server_timing.SERVER_TIMING_SAMPLE > 0:
+    app.add_middleware(server_timing.ServerTimingMiddleware)
+
+# Число и время SQL запросов на HTTP запрос, бюджеты запросов маршрутов
+app.add_middleware(budgets.QueryBudgetMiddleware)
+
+# Трассировка: спаны вокруг каждого слоя middleware выше и корневой span запроса
+if tracing.TRACING_ENABLED:
+    tracing.instrument_middleware(app)
+    app.add_middleware(tracing.TracingMiddleware)
+
+# Burn rate SLO маршрутов (@slo.objective)
+app.add_middleware(slo.SLOMiddleware, routes=app.routes)
+
+# Мониторинг всех запросов (внешний middleware: время включает остальные слои)
+app.add_middleware(metrics.RequestMetricsMiddleware, routes=app.routes)
 
 # HTML документация
 DOCS_HTML = """
@@ -210,6 +220,14 @@ DOCS_HTML = """
   -d '{"student_id": 1, "time_spent": 1800}'</div>
             </div>
             
+            <div class="endpoint">
+                <h3><span class="method method-POST">POST</span>/api/v1/lessons/{id}/heartbeat</h3>
+                <p>Report time spent on a lesson since the previous heartbeat</p>
+                <div class="code">curl -X POST http://localhost:8000/api/v1/lessons/1/heartbeat \\<br>
+  -H "Content-Type: application/json" \\<br>
+  -d '{"student_id": 1, "seconds": 15}'</div>
+            </div>
+            
             <div class="endpoint">
                 <h3><span class="method method-POST">POST</span>/api/v1/submissions</h3>
                 <p>Submit assignment solution</p>
@@ -388,6 +406,9 @@ LOAD_TEST_HTML = """
         let isRunning = false;
         let totalRequests = 0;
         let successfulRequests = 0;
+        // Суммы компонентов Server-Timing (мс), если сервер его отдает
+        let timingTotals = {};
+        let timedRequests = 0;
 
         document.getElementById('loadTestForm').addEventListener('submit', function(e) {
             e.preventDefault();
@@ -408,6 +429,8 @@ LOAD_TEST_HTML = """
             isRunning = true;
             totalRequests = 0;
             successfulRequests = 0;
+            timingTotals = {};
+            timedRequests = 0;
             
             // Update UI
             document.getElementById('startButton').style.display = 'none';
@@ -445,7 +468,7 @@ LOAD_TEST_HTML = """
             document.getElementById('stopButton').style.display = 'none';
             
             const successRate = totalRequests > 0 ? (successfulRequests / totalRequests * 100).toFixed(1) : 0;
-            showStatus(`Load test completed. Total: ${totalRequests}, Success: ${successfulRequests} (${successRate}%)`, 'success');
+            showStatus(`Load test completed. Total: ${totalRequests}, Success: ${successfulRequests} (${successRate}%)${timingSummary()}`, 'success');
         }
 
         function sendRequest(endpoint) {
@@ -456,6 +479,7 @@ LOAD_TEST_HTML = """
                     if (response.ok) {
                         successfulRequests++;
                     }
+                    addServerTiming(response.headers.get('Server-Timing'));
                 })
                 .catch(error => {
                     console.error('Request failed:', error);
@@ -464,10 +488,28 @@ LOAD_TEST_HTML = """
             // Update status every 50 requests
             if (totalRequests % 50 === 0) {
                 const successRate = (successfulRequests / totalRequests * 100).toFixed(1);
-                showStatus(`Running... Sent: ${totalRequests}, Success: ${successfulRequests} (${successRate}%)`, 'info');
+                showStatus(`Running... Sent: ${totalRequests}, Success: ${successfulRequests} (${successRate}%)${timingSummary()}`, 'info');
             }
         }
 
+        function addServerTiming(header) {
+            if (!header) return;
+            timedRequests++;
+            header.split(',').forEach(metric => {
+                const [name, ...params] = metric.trim().split(';');
+                const dur = params.find(param => param.startsWith('dur='));
+                if (dur) {
+                    timingTotals[name] = (timingTotals[name] || 0) + parseFloat(dur.slice(4));
+                }
+            });
+        }
+
+        function timingSummary() {
+            if (timedRequests === 0) return '';
+            const parts = Object.entries(timingTotals).map(([name, total]) => `${name} ${(total / timedRequests).toFixed(2)}`);
+            return ` | avg ms: ${parts.join(', ')}`;
+        }
+
         function showStatus(message, type) {
             const status = document.getElementById('status');
             status.textContent = message;
@@ -479,20 +521,60 @@ LOAD_TEST_HTML = """
 </html>
 """
 
+@app.on_event("startup")
+def start_background_tasks():
+    # Проверка отставания реплик для маршрутизации чтения
+    replica_router.start()
+    slow_queries.log.start()
+    runtime.start()
+    if loop_monitor.LOOP_MONITOR_ENABLED:
+        loop_monitor.monitor.start()
+    if profiler.PROFILER_CONTINUOUS:
+        profiler.continuous.start(app.routes)
+    if tracing.TRACING_ENABLED:
+        tracing.exporter.start()
+    heartbeats.aggregator.start()
+    if idempotency.IDEMPOTENCY_ENABLED:
+        idempotency.cleanup.start()
+    if group_commit.GROUP_COMMIT_ENABLED:
+        group_commit.writer.start()
+    if write_behind.WRITE_BEHIND_ENABLED:
+        for buffer in write_behind.buffers:
+            buffer.start()
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    # Буферы write-behind сбрасываются в БД до остановки
+    for buffer in write_behind.buffers:
+        buffer.stop()
+    group_commit.writer.stop()
+    heartbeats.aggregator.stop()
+    idempotency.cleanup.stop()
+    slow_queries.log.stop()
+    tracing.exporter.stop()
+    loop_monitor.monitor.stop()
+    profiler.continuous.stop()
+    runtime.stop()
+    replica_router.stop()
+
+# Статические страницы сжимаются один раз при старте
+DOCS_PAGE = compression.StaticPage(DOCS_HTML)
+LOAD_TEST_PAGE = compression.StaticPage(LOAD_TEST_HTML)
+
 # Роутеры
 
 # Главная страница и документация
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    return HTMLResponse(content=DOCS_HTML)
+async def root(request: Request):
+    return DOCS_PAGE.response(request)
 
 @app.get("/docs", response_class=HTMLResponse)
-async def docs():
-    return HTMLResponse(content=DOCS_HTML)
+async def docs(request: Request):
+    return DOCS_PAGE.response(request)
 
 @app.get("/load-test", response_class=HTMLResponse)
-async def load_test_ui():
-    return HTMLResponse(content=LOAD_TEST_HTML)
+async def load_test_ui(request: Request):
+    return LOAD_TEST_PAGE.response(request)
 
 # Health check
 @app.get("/health")
@@ -516,16 +598,23 @@ async def health_check(db: Session = Depends(get_db)):
 
 # Метрики
 @app.get("/metrics", response_class=PlainTextResponse)
-async def get_metrics(db: Session = Depends(get_db)):
+async def get_metrics(request: Request, db: Session = Depends(get_db)):
     # Обновляем бизнес-метрики перед экспортом
     metrics.update_business_metrics(db)
-    return metrics.get_metrics()
+    runtime.update_metrics()
+    # Prometheus со scrape_protocols OpenMetrics получает и exemplars
+    content, media_type = metrics.exposition(request.headers.get("accept"))
+    return Response(content=content, headers={"Content-Type": media_type})
 
 # API Endpoints
+# query_budget - сколько SQL запросов положено маршруту, включая set_config дедлайна
+# в начале транзакции и резервирование Idempotency-Key у POST
+# slo.objective - порог латентности (для 99% запросов, если не указано иное) и доступность
 
 # Студенты
 @app.post("/api/v1/students", response_model=schemas.Student)
-@metrics.monitor_db_operation("create_student")
+@budgets.query_budget(4)
+@slo.objective(latency_ms=250)
 async def create_student(student: schemas.StudentCreate, db: Session = Depends(get_db)):
     # Проверяем, не существует ли студент с таким email
     db_student = crud.get_student_by_email(db, email=student.email)
@@ -535,36 +624,41 @@ async def create_student(student: schemas.StudentCreate, db: Session = Depends(g
     return crud.create_student(db=db, student=student)
 
 @app.get("/api/v1/students/{student_id}/progress", response_model=schemas.StudentProgress)
-@metrics.monitor_db_operation("get_student_progress")
-async def get_student_progress(student_id: int, db: Session = Depends(get_db)):
-    student = crud.get_student(db, student_id=student_id)
-    if student is None:
+@budgets.query_budget(2)
+@slo.objective(latency_ms=200)
+def get_student_progress(student_id: int, db: Session = Depends(get_db)):
+    progress = reads.get_student_progress(db=db, student_id=student_id)
+    if progress is None:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    return crud.get_student_progress(db=db, student_id=student_id)
+    return progress
 
 # Курсы
 @app.post("/api/v1/courses", response_model=schemas.Course)
-@metrics.monitor_db_operation("create_course")
+@budgets.query_budget(3)
+@slo.objective(latency_ms=250)
 async def create_course(course: schemas.CourseCreate, db: Session = Depends(get_db)):
     return crud.create_course(db=db, course=course)
 
-@app.get("/api/v1/courses", response_model=List[schemas.Course])
-@metrics.monitor_db_operation("get_courses")
-async def get_courses(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    courses = crud.get_courses(db, skip=skip, limit=limit)
-    return courses
+@app.get("/api/v1/courses", response_model=List[schemas.Course], responses=serialization.LIST_RESPONSES)
+@budgets.query_budget(2)
+@slo.objective(latency_ms=100)
+async def get_courses(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    courses = reads.get_courses(db, skip=skip, limit=limit)
+    return serialization.list_response(schemas.Course, courses, request.headers.get("accept"))
 
 @app.get("/api/v1/courses/{course_id}", response_model=schemas.Course)
-@metrics.monitor_db_operation("get_course")
+@budgets.query_budget(2)
+@slo.objective(latency_ms=100)
 async def get_course(course_id: int, db: Session = Depends(get_db)):
-    course = crud.get_course(db, course_id=course_id)
+    course = reads.get_course(db, course_id=course_id)
     if course is None:
         raise HTTPException(status_code=404, detail="Course not found")
-    return course
+    return serialization.json_response(schemas.Course, course)
 
 @app.post("/api/v1/courses/{course_id}/enroll")
-@metrics.monitor_db_operation("enroll_student")
+@budgets.query_budget(6)
+@slo.objective(latency_ms=250)
 async def enroll_student(course_id: int, enrollment: schemas.EnrollmentCreate, db: Session = Depends(get_db)):
     # Проверяем существование курса и студента
     course = crud.get_course(db, course_id=course_id)
@@ -581,20 +675,33 @@ async def enroll_student(course_id: int, enrollment: schemas.EnrollmentCreate, d
     
     return {"message": "Student enrolled successfully", "enrollment_id": result.id}
 
-@app.get("/api/v1/courses/{course_id}/lessons", response_model=List[schemas.Lesson])
-@metrics.monitor_db_operation("get_course_lessons")
-async def get_course_lessons(course_id: int, db: Session = Depends(get_db)):
-    course = crud.get_course(db, course_id=course_id)
-    if not course:
+@app.get("/api/v1/courses/{course_id}/lessons", response_model=List[schemas.Lesson], responses=serialization.LIST_RESPONSES)
+@budgets.query_budget(3)
+@slo.objective(latency_ms=100)
+async def get_course_lessons(request: Request, course_id: int, db: Session = Depends(get_db)):
+    if not reads.course_exists(db, course_id=course_id):
         raise HTTPException(status_code=404, detail="Course not found")
     
-    return crud.get_course_lessons(db=db, course_id=course_id)
+    lessons = reads.get_course_lessons(db=db, course_id=course_id)
+    return serialization.list_response(schemas.Lesson, lessons, request.headers.get("accept"))
 
 # Прохождение уроков
 @app.post("/api/v1/lessons/{lesson_id}/complete")
-@metrics.monitor_db_operation("complete_lesson")
+@budgets.query_budget(4)
+@slo.objective(latency_ms=250)
 async def complete_lesson(lesson_id: int, completion: schemas.LessonCompletionCreate, db: Session = Depends(get_db)):
-    result = crud.complete_lesson(db=db, lesson_id=lesson_id, completion=completion)
+    if write_behind.WRITE_BEHIND_ENABLED:
+        if not crud.enqueue_lesson_completion(lesson_id, completion):
+            raise HTTPException(status_code=503, detail="Write buffer is full, retry later", headers={"Retry-After": "1"})
+        metrics.increment_lesson_completion()
+        return JSONResponse(status_code=202, content={"message": "Lesson completion accepted"})
+
+    if group_commit.GROUP_COMMIT_ENABLED:
+        result = await group_commit.writer.submit(
+            crud.add_lesson_completion, lesson_id, completion, client_id=db.info.get("client_id")
+        )
+    else:
+        result = crud.complete_lesson(db=db, lesson_id=lesson_id, completion=completion)
     if result is None:
         raise HTTPException(status_code=400, detail="Lesson already completed by this student")
     
@@ -603,28 +710,123 @@ async def complete_lesson(lesson_id: int, completion: schemas.LessonCompletionCr
     
     return {"message": "Lesson completed successfully", "completion_id": result.id}
 
+# Время на уроке: heartbeat копятся в памяти и пишутся в lesson_time пачками,
+# поэтому эндпоинт не ходит в БД
+@app.post("/api/v1/lessons/{lesson_id}/heartbeat", status_code=202)
+@budgets.query_budget(1)
+@slo.objective(latency_ms=50)
+async def lesson_heartbeat(lesson_id: int, heartbeat: schemas.LessonHeartbeat):
+    if not heartbeats.aggregator.add(heartbeat.student_id, lesson_id, heartbeat.seconds):
+        raise HTTPException(status_code=503, detail="Too many pending heartbeats, retry later", headers={"Retry-After": "1"})
+    return Response(status_code=202)
+
 # Решения заданий
 @app.post("/api/v1/submissions", response_model=schemas.Submission)
-@metrics.monitor_db_operation("create_submission")
+@budgets.query_budget(3)
+@slo.objective(latency_ms=250)
 async def create_submission(submission: schemas.SubmissionCreate, db: Session = Depends(get_db)):
-    result = crud.create_submission(db=db, submission=submission)
+    if write_behind.WRITE_BEHIND_ENABLED:
+        if not crud.enqueue_submission(submission):
+            raise HTTPException(status_code=503, detail="Write buffer is full, retry later", headers={"Retry-After": "1"})
+        metrics.increment_submission(status="pending")
+        return JSONResponse(status_code=202, content={"message": "Submission accepted"})
+
+    if group_commit.GROUP_COMMIT_ENABLED:
+        result = await group_commit.writer.submit(
+            crud.add_submission, submission, client_id=db.info.get("client_id")
+        )
+    else:
+        result = crud.create_submission(db=db, submission=submission)
     
     # Инкрементируем метрику
     metrics.increment_submission(status="pending")
     
     return result
 
-@app.get("/api/v1/submissions", response_model=List[schemas.Submission])
-@metrics.monitor_db_operation("get_submissions")
-async def get_submissions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_submissions(db=db, skip=skip, limit=limit)
+@app.get("/api/v1/submissions", response_model=List[schemas.Submission], responses=serialization.LIST_RESPONSES)
+@budgets.query_budget(2)
+@slo.objective(latency_ms=100)
+async def get_submissions(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    submissions = reads.get_submissions(db=db, skip=skip, limit=limit)
+    return serialization.list_response(schemas.Submission, submissions, request.headers.get("accept"))
 
 # Аналитика (медленные запросы)
-@app.get("/api/v1/analytics/courses", response_model=List[schemas.CourseAnalytics])
-@metrics.monitor_db_operation("get_course_analytics")
-async def get_course_analytics(db: Session = Depends(get_db)):
-    """Медленный эндпоинт для тестирования алертов по латенси"""
-    return crud.get_course_analytics(db=db)
+@app.get("/api/v1/analytics/courses", response_model=List[schemas.CourseAnalytics], responses=serialization.LIST_RESPONSES)
+@budgets.query_budget(2)
+@slo.objective(latency_ms=1000, latency_target=0.95, availability=0.99)
+def get_course_analytics(request: Request, db: Session = Depends(get_db)):
+    """Медленный эндпоинт для тестирования алертов по латенси.
+
+    Обычная (не async) функция выполняется в пуле потоков, поэтому event loop
+    успевает заметить отключение клиента и отменить запрос в БД.
+    """
+    analytics = reads.get_course_analytics(db=db)
+    return serialization.list_response(schemas.CourseAnalytics, analytics, request.headers.get("accept"))
+
+# Диагностика (заголовок X-Admin-Token)
+@app.get("/admin/slow-queries", dependencies=[Depends(admin.require_admin)])
+@budgets.query_budget(0)
+async def get_slow_queries(limit: int = 50):
+    return {
+        "threshold_ms": slow_queries.SLOW_QUERY_THRESHOLD_MS,
+        "entries": slow_queries.log.entries(limit),
+    }
+
+@app.get("/admin/loop-blocks", dependencies=[Depends(admin.require_admin)])
+@budgets.query_budget(0)
+async def get_loop_blocks(limit: int = 20):
+    return {
+        "threshold_ms": loop_monitor.LOOP_BLOCK_THRESHOLD_MS,
+        "blocks": loop_monitor.monitor.blocks(limit),
+    }
+
+# Синхронный маршрут: поток пула ждет seconds секунд, event loop свободен
+@app.get("/admin/profile", dependencies=[Depends(admin.require_admin)])
+@budgets.query_budget(0)
+def get_profile(seconds: float = 10, format: str = "collapsed"):
+    if not 0 < seconds <= profiler.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {profiler.PROFILE_MAX_SECONDS:g}]")
+    if format not in profiler.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(profiler.FORMATS)}")
+    profile = profiler.collect(app.routes, seconds)
+    if format == "speedscope":
+        return Response(profile.render(format), media_type="application/json")
+    return PlainTextResponse(profile.render(format))
+
+def require_tracemalloc(group_by: str = "lineno"):
+    if not runtime.tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not tracing (TRACEMALLOC_ENABLED)")
+    if group_by not in runtime.GROUP_BY:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(runtime.GROUP_BY)}")
+
+# Снимки памяти - синхронные маршруты: take_snapshot на большой куче занимает секунды
+@app.post("/admin/tracemalloc/snapshots", dependencies=[Depends(admin.require_admin), Depends(require_tracemalloc)])
+@budgets.query_budget(0)
+def create_tracemalloc_snapshot(group_by: str = "lineno", limit: int = 20):
+    summary = runtime.snapshots.take()
+    return {**summary, "top": runtime.snapshots.top(summary["id"], group_by, limit)}
+
+@app.get("/admin/tracemalloc/snapshots", dependencies=[Depends(admin.require_admin), Depends(require_tracemalloc)])
+@budgets.query_budget(0)
+def get_tracemalloc_snapshots():
+    return runtime.snapshots.summaries()
+
+@app.get("/admin/tracemalloc/snapshots/{snapshot_id}", dependencies=[Depends(admin.require_admin), Depends(require_tracemalloc)])
+@budgets.query_budget(0)
+def get_tracemalloc_snapshot(snapshot_id: int, group_by: str = "lineno", limit: int = 20):
+    top = runtime.snapshots.top(snapshot_id, group_by, limit)
+    if top is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return top
+
+# Рост памяти между снимками: base - ранний, target - поздний
+@app.get("/admin/tracemalloc/diff", dependencies=[Depends(admin.require_admin), Depends(require_tracemalloc)])
+@budgets.query_budget(0)
+def get_tracemalloc_diff(base: int, target: int, group_by: str = "lineno", limit: int = 20):
+    diff = runtime.snapshots.diff(base, target, group_by, limit)
+    if diff is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return diff
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,13 +1,22 @@
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from prometheus_client.core import CollectorRegistry
+from prometheus_client import GCCollector, PlatformCollector, ProcessCollector
+from prometheus_client.core import CollectorRegistry, HistogramMetricFamily
+from prometheus_client.openmetrics import exposition as openmetrics
+import os
 import time
-from functools import wraps
 from sqlalchemy.orm import Session
-from . import models
 
 # Создаем собственный реестр метрик
 REGISTRY = CollectorRegistry()
 
+# Границы гистограммы длительности HTTP запросов (сек): от 1 мс, чтобы p50/p99
+# здоровых запросов (единицы-десятки мс) не попадали в один первый bucket
+HTTP_DURATION_BUCKETS = [
+    float(bucket) for bucket in os.getenv(
+        "HTTP_DURATION_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",")
+]
+
 # Метрики HTTP запросов
 http_requests_total = Counter(
     'learntracker_http_requests_total',
@@ -20,24 +29,493 @@ http_request_duration = Histogram(
     'learntracker_http_request_duration_seconds',
     'HTTP request duration in seconds',
     ['method', 'endpoint'],
-    buckets=[0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    buckets=HTTP_DURATION_BUCKETS,
+    registry=REGISTRY
+)
+
+# SLO маршрутов (slo.py): sli - latency или availability, window - окно burn rate
+slo_burn_rate = Gauge(
+    'learntracker_slo_burn_rate',
+    'Error budget burn rate over the window (1 = budget lasts exactly the SLO period)',
+    ['method', 'endpoint', 'sli', 'window'],
+    registry=REGISTRY
+)
+
+slo_target = Gauge(
+    'learntracker_slo_target',
+    'SLO target ratio of good requests',
+    ['method', 'endpoint', 'sli'],
     registry=REGISTRY
 )
 
-# Метрики БД
+slo_latency_threshold = Gauge(
+    'learntracker_slo_latency_threshold_seconds',
+    'Latency SLO threshold: requests slower than this are bad',
+    ['method', 'endpoint'],
+    registry=REGISTRY
+)
+
+# Метрики БД (по SQL запросам, обновляются событиями engine, см. queries.py):
+# operation - функция crud/reads, fingerprint - отпечаток запроса
 db_queries_total = Counter(
     'learntracker_db_queries_total',
     'Total database queries',
+    ['operation', 'fingerprint'],
+    registry=REGISTRY
+)
+
+db_query_duration_seconds = Histogram(
+    'learntracker_db_query_duration_seconds',
+    'Database query execution time',
+    ['operation', 'fingerprint'],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+    registry=REGISTRY
+)
+
+db_rows_returned_total = Counter(
+    'learntracker_db_rows_returned_total',
+    'Rows returned by database queries',
+    ['operation', 'fingerprint'],
+    registry=REGISTRY
+)
+
+db_query_errors_total = Counter(
+    'learntracker_db_query_errors_total',
+    'Failed database queries by SQLSTATE class',
+    ['operation', 'sqlstate_class'],
+    registry=REGISTRY
+)
+
+db_statement_info = Gauge(
+    'learntracker_db_statement_info',
+    'Normalized SQL text of a query fingerprint',
+    ['fingerprint', 'statement'],
+    registry=REGISTRY
+)
+
+# SQL запросы на один HTTP запрос (см. budgets.py)
+http_request_db_queries = Histogram(
+    'learntracker_http_request_db_queries',
+    'Database queries executed per HTTP request',
+    ['method', 'endpoint'],
+    buckets=[0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50],
+    registry=REGISTRY
+)
+
+http_request_db_seconds = Histogram(
+    'learntracker_http_request_db_seconds',
+    'Total database query time per HTTP request',
+    ['method', 'endpoint'],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+    registry=REGISTRY
+)
+
+query_budget_violations_total = Counter(
+    'learntracker_query_budget_violations_total',
+    'Requests over their query budget (budget) or repeating one statement (repeat)',
+    ['endpoint', 'kind'],
+    registry=REGISTRY
+)
+
+# Журнал медленных SQL запросов (slow_queries.py)
+slow_queries_total = Counter(
+    'learntracker_slow_queries_total',
+    'SQL queries slower than SLOW_QUERY_THRESHOLD_MS',
     ['operation'],
     registry=REGISTRY
 )
 
+slow_query_explains_total = Counter(
+    'learntracker_slow_query_explains_total',
+    'EXPLAIN plans captured for slow queries by outcome (captured, failed)',
+    ['outcome'],
+    registry=REGISTRY
+)
+
+slow_query_log_dropped_total = Counter(
+    'learntracker_slow_query_log_dropped_total',
+    'Slow query entries not written to the log file because the queue was full',
+    registry=REGISTRY
+)
+
 db_connections_active = Gauge(
     'learntracker_db_connections_active',
     'Active database connections',
     registry=REGISTRY
 )
 
+# Метрики пулов соединений (обновляются событиями пула, см. pool.py)
+db_pool_size = Gauge(
+    'learntracker_db_pool_size',
+    'Configured pool size',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+db_pool_checked_out = Gauge(
+    'learntracker_db_pool_checked_out',
+    'Connections checked out from the route class pool',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+db_pool_overflow = Gauge(
+    'learntracker_db_pool_overflow',
+    'Overflow connections currently open beyond pool size',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+db_pool_wait_seconds = Histogram(
+    'learntracker_db_pool_wait_seconds',
+    'Time spent waiting to check out a pooled connection',
+    ['route_class'],
+    buckets=[0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    registry=REGISTRY
+)
+
+db_connection_hold_seconds = Histogram(
+    'learntracker_db_connection_hold_seconds',
+    'Time a connection stays checked out of the pool',
+    ['route_class'],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    registry=REGISTRY
+)
+
+db_request_connection_hold_seconds = Histogram(
+    'learntracker_db_request_connection_hold_seconds',
+    'Total time a request held database connections',
+    ['route_class'],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    registry=REGISTRY
+)
+
+db_pool_connects_total = Counter(
+    'learntracker_db_pool_connects_total',
+    'New DBAPI connections opened by the pool',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+db_pool_invalidations_total = Counter(
+    'learntracker_db_pool_invalidations_total',
+    'Pooled connections invalidated',
+    ['route_class', 'soft'],
+    registry=REGISTRY
+)
+
+db_pool_exhausted_total = Counter(
+    'learntracker_db_pool_exhausted_total',
+    'Checkouts that found the pool at full capacity and had to wait',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+db_pool_timeouts_total = Counter(
+    'learntracker_db_pool_timeouts_total',
+    'Checkouts that timed out waiting for a connection',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+db_pool_recommended_size = Gauge(
+    'learntracker_db_pool_recommended_size',
+    'Pool size recommended by the autotuner',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+# Метрики admission control (по классам маршрутов)
+admission_inflight = Gauge(
+    'learntracker_admission_inflight',
+    'Requests currently admitted and in flight',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+admission_queued = Gauge(
+    'learntracker_admission_queued',
+    'Requests waiting in the admission queue',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+admission_limit = Gauge(
+    'learntracker_admission_limit',
+    'Current adaptive concurrency limit',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+admission_shed_total = Counter(
+    'learntracker_admission_shed_total',
+    'Requests rejected with 503 by admission control',
+    ['route_class', 'reason'],
+    registry=REGISTRY
+)
+
+# Метрики bulkheads (классы маршрутов с отдельными пулами соединений)
+bulkhead_budget = Gauge(
+    'learntracker_bulkhead_budget',
+    'Concurrency budget (connection pool capacity) of the route class',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+bulkhead_saturation = Gauge(
+    'learntracker_bulkhead_saturation',
+    'Share of the route class concurrency budget in use (0..1)',
+    ['route_class'],
+    registry=REGISTRY
+)
+
+# Метрики реплик для чтения
+db_replica_lag_seconds = Gauge(
+    'learntracker_db_replica_lag_seconds',
+    'Measured replication lag of the read replica (-1 if unknown)',
+    ['replica'],
+    registry=REGISTRY
+)
+
+db_replica_healthy = Gauge(
+    'learntracker_db_replica_healthy',
+    '1 if the replica is within the allowed lag and receives reads',
+    ['replica'],
+    registry=REGISTRY
+)
+
+db_reads_routed_total = Counter(
+    'learntracker_db_reads_routed_total',
+    'Read sessions routed to a replica or back to the primary',
+    ['target', 'reason'],
+    registry=REGISTRY
+)
+
+# Запросы, брошенные из-за дедлайна или отключения клиента
+requests_abandoned_total = Counter(
+    'learntracker_requests_abandoned_total',
+    'Requests abandoned because of a deadline or client disconnect',
+    ['route_class', 'reason'],
+    registry=REGISTRY
+)
+
+# Метрики group commit (общий commit для конкурентных записей)
+group_commit_batch_size = Histogram(
+    'learntracker_group_commit_batch_size',
+    'Writes committed in one group commit transaction',
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256],
+    registry=REGISTRY
+)
+
+group_commit_duration_seconds = Histogram(
+    'learntracker_group_commit_duration_seconds',
+    'Time to execute and commit one group commit batch',
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+    registry=REGISTRY
+)
+
+group_commit_wait_seconds = Histogram(
+    'learntracker_group_commit_wait_seconds',
+    'Time from enqueueing a write to its acknowledgement after commit',
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+    registry=REGISTRY
+)
+
+group_commit_queued = Gauge(
+    'learntracker_group_commit_queued',
+    'Writes waiting for the group commit writer',
+    registry=REGISTRY
+)
+
+# Метрики write-behind буферов (по таблицам)
+write_behind_depth = Gauge(
+    'learntracker_write_behind_depth',
+    'Events waiting in the write-behind buffer',
+    ['table'],
+    registry=REGISTRY
+)
+
+write_behind_flush_seconds = Histogram(
+    'learntracker_write_behind_flush_seconds',
+    'Time to bulk insert one write-behind batch',
+    ['table'],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+    registry=REGISTRY
+)
+
+write_behind_flushed_total = Counter(
+    'learntracker_write_behind_flushed_total',
+    'Events written to the database by write-behind flushes',
+    ['table'],
+    registry=REGISTRY
+)
+
+write_behind_dropped_total = Counter(
+    'learntracker_write_behind_dropped_total',
+    'Write-behind events dropped (buffer full, rejected by the database, flush error)',
+    ['table', 'reason'],
+    registry=REGISTRY
+)
+
+# Метрики heartbeat (время на уроках, агрегируется в памяти)
+heartbeats_total = Counter(
+    'learntracker_heartbeats_total',
+    'Lesson heartbeats accepted',
+    registry=REGISTRY
+)
+
+heartbeat_pending_keys = Gauge(
+    'learntracker_heartbeat_pending_keys',
+    'Student-lesson pairs with time not yet written to lesson_time',
+    registry=REGISTRY
+)
+
+heartbeat_flush_seconds = Histogram(
+    'learntracker_heartbeat_flush_seconds',
+    'Time to upsert aggregated heartbeat time into lesson_time',
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+    registry=REGISTRY
+)
+
+heartbeat_dropped_total = Counter(
+    'learntracker_heartbeat_dropped_total',
+    'Heartbeat student-lesson pairs dropped (too many pending, rejected by the database, flush error)',
+    ['reason'],
+    registry=REGISTRY
+)
+
+# Event loop (loop_monitor.py): задержка и блокировки по маршрутам, в которых они случились
+event_loop_lag_seconds = Histogram(
+    'learntracker_event_loop_lag_seconds',
+    'Event loop scheduling lag',
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+    registry=REGISTRY
+)
+
+event_loop_blocked_seconds_total = Counter(
+    'learntracker_event_loop_blocked_seconds_total',
+    'Time the event loop was blocked longer than LOOP_BLOCK_THRESHOLD_MS',
+    ['endpoint'],
+    registry=REGISTRY
+)
+
+event_loop_blocks_total = Counter(
+    'learntracker_event_loop_blocks_total',
+    'Event loop blocks longer than LOOP_BLOCK_THRESHOLD_MS',
+    ['endpoint'],
+    registry=REGISTRY
+)
+
+# Процесс и интерпретатор. Собственный реестр, в отличие от реестра по умолчанию,
+# не содержит стандартных коллекторов: CPU, RSS, открытые fd (process_*), версия
+# Python (python_info), объекты и сборки GC по поколениям (python_gc_*).
+# Имена стандартные, чтобы подходили готовые дашборды
+ProcessCollector(registry=REGISTRY)
+PlatformCollector(registry=REGISTRY)
+GCCollector(registry=REGISTRY)
+
+GC_PAUSE_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+
+class GCPauseCollector:
+    """Гистограмма пауз сборщика мусора по поколениям (callback в gc.callbacks, см. runtime.py).
+
+    Callback вызывается внутри сборки и не берет блокировок: сборка может начаться,
+    пока поток держит блокировку метрики prometheus_client. Поэтому счетчики -
+    обычные списки, а гистограмма собирается при экспорте.
+    """
+
+    def __init__(self, buckets=GC_PAUSE_BUCKETS):
+        self.buckets = buckets
+        self._counts = [[0] * (len(buckets) + 1) for _ in range(3)]
+        self._sums = [0.0] * 3
+        self._started_at = None
+
+    def callback(self, phase: str, info: dict):
+        if phase == "start":
+            self._started_at = time.perf_counter()
+            return
+        if self._started_at is None:
+            return
+        pause = time.perf_counter() - self._started_at
+        self._started_at = None
+        generation = info["generation"]
+        index = 0
+        while index < len(self.buckets) and pause > self.buckets[index]:
+            index += 1
+        self._counts[generation][index] += 1
+        self._sums[generation] += pause
+
+    def collect(self):
+        family = HistogramMetricFamily(
+            'learntracker_gc_pause_seconds', 'Garbage collector pause duration', labels=['generation']
+        )
+        for generation in range(3):
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + [float("inf")], self._counts[generation]):
+                cumulative += count
+                buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+            family.add_metric([str(generation)], buckets, self._sums[generation])
+        yield family
+
+
+gc_pauses = GCPauseCollector()
+REGISTRY.register(gc_pauses)
+
+# Потоки и задачи (обновляются перед экспортом, см. runtime.update_metrics)
+threads = Gauge(
+    'learntracker_threads',
+    'Live Python threads',
+    registry=REGISTRY
+)
+
+threadpool_busy = Gauge(
+    'learntracker_threadpool_busy',
+    'Threadpool slots in use (sync routes and run_in_threadpool)',
+    registry=REGISTRY
+)
+
+threadpool_limit = Gauge(
+    'learntracker_threadpool_limit',
+    'Threadpool size limit',
+    registry=REGISTRY
+)
+
+asyncio_tasks = Gauge(
+    'learntracker_asyncio_tasks',
+    'Unfinished asyncio tasks on the event loop',
+    registry=REGISTRY
+)
+
+tracemalloc_traced_bytes = Gauge(
+    'learntracker_tracemalloc_traced_bytes',
+    'Memory traced by tracemalloc (0 when TRACEMALLOC_ENABLED is off)',
+    registry=REGISTRY
+)
+
+# Трассировка (tracing.py): decision - head, error, slow (трасса сохранена),
+# discarded, export_dropped (очередь экспорта переполнена)
+traces_total = Counter(
+    'learntracker_traces_total',
+    'Request traces by sampling decision',
+    ['decision'],
+    registry=REGISTRY
+)
+
+trace_export_failures_total = Counter(
+    'learntracker_trace_export_failures_total',
+    'Failed trace export batches',
+    registry=REGISTRY
+)
+
+# Метрики Idempotency-Key (new, replay_memory, replay_db, coalesced, in_progress, mismatch)
+idempotency_requests_total = Counter(
+    'learntracker_idempotency_requests_total',
+    'POST requests with an Idempotency-Key by outcome',
+    ['outcome'],
+    registry=REGISTRY
+)
+
 # Бизнес-метрики
 courses_total = Gauge(
     'learntracker_courses_total',
@@ -64,69 +542,97 @@ submissions_total = Counter(
     registry=REGISTRY
 )
 
-# Декоратор для мониторинга HTTP запросов
-def monitor_requests(endpoint: str):
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            start_time = time.time()
-            status = "200"
-            method = "GET"  # По умолчанию, можно улучшить
-            
-            try:
-                result = await func(*args, **kwargs)
-                return result
-            except Exception as e:
-                status = "500"
-                raise
-            finally:
-                # Записываем метрики
-                duration = time.time() - start_time
-                http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
-                http_request_duration.labels(method=method, endpoint=endpoint).observe(duration)
-        
-        return wrapper
-    return decorator
-
-# Декоратор для мониторинга БД операций
-def monitor_db_operation(operation: str):
-    def decorator(func):
-        @wraps(func)
-        async def async_wrapper(*args, **kwargs):
-            start_time = time.time()
-            
-            try:
-                result = await func(*args, **kwargs)
-                db_queries_total.labels(operation=operation).inc()
-                return result
-            except Exception as e:
-                db_queries_total.labels(operation=f"{operation}_error").inc()
-                raise
-                
-        @wraps(func)
-        def sync_wrapper(*args, **kwargs):
-            start_time = time.time()
-            
-            try:
-                result = func(*args, **kwargs)
-                db_queries_total.labels(operation=operation).inc()
-                return result
-            except Exception as e:
-                db_queries_total.labels(operation=f"{operation}_error").inc()
-                raise
-        
-        # Проверяем, является ли функция асинхронной
-        import asyncio
-        if asyncio.iscoroutinefunction(func):
-            return async_wrapper
-        else:
-            return sync_wrapper
-            
-    return decorator
+# Метка endpoint - шаблон маршрута (/api/v1/courses/{course_id}), а не путь запроса,
+# поэтому число серий ограничено числом маршрутов. Пути без маршрута (404, сканеры)
+# попадают в одну метку
+UNMATCHED_ENDPOINT = "unmatched"
+HTTP_METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware: число и длительность HTTP запросов по шаблонам маршрутов"""
+
+    def __init__(self, app, routes):
+        self.app = app
+        # Список маршрутов приложения; читается при первом запросе, когда все маршруты уже объявлены
+        self.routes = routes
+        self._templates = None
+        self._durations = {}
+        self._counters = {}
+
+    def _bind_children(self):
+        # Дочерние серии создаются заранее: на запросе остается поиск в dict
+        self._templates = {}
+        for route in self.routes:
+            endpoint = getattr(route, "endpoint", None)
+            template = getattr(route, "path_format", None)
+            if endpoint is None or template is None:
+                continue
+            self._templates[endpoint] = template
+            for method in getattr(route, "methods", None) or ():
+                self._durations[(method, template)] = http_request_duration.labels(method=method, endpoint=template)
+        for method in HTTP_METHODS + ("OTHER",):
+            self._durations[(method, UNMATCHED_ENDPOINT)] = http_request_duration.labels(
+                method=method, endpoint=UNMATCHED_ENDPOINT
+            )
+
+    def _observe(self, method: str, template: str, status: int, duration: float, trace_id=None):
+        key = (method, template)
+        histogram = self._durations.get(key)
+        if histogram is None:
+            # Метод, которого нет у маршрута (405)
+            histogram = self._durations[key] = http_request_duration.labels(method=method, endpoint=template)
+        # Сохраненная трасса запроса - exemplar (виден в формате OpenMetrics)
+        histogram.observe(duration, {"trace_id": trace_id} if trace_id is not None else None)
+        counter_key = (method, template, status)
+        counter = self._counters.get(counter_key)
+        if counter is None:
+            counter = self._counters[counter_key] = http_requests_total.labels(
+                method=method, endpoint=template, status=str(status)
+            )
+        counter.inc()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._templates is None:
+            self._bind_children()
+
+        start_time = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Роутер кладет найденный endpoint в тот же scope
+            template = self._templates.get(scope.get("endpoint"), UNMATCHED_ENDPOINT)
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+            self._observe(method, template, status, time.perf_counter() - start_time, scope.get("trace_id"))
+
+# Бизнес-метрики пересчитываются не чаще раза в BUSINESS_METRICS_INTERVAL секунд,
+# чтобы частые /metrics и /health не брали соединение ради count()
+BUSINESS_METRICS_INTERVAL = float(os.getenv("BUSINESS_METRICS_INTERVAL", "15"))
+_business_metrics_updated_at = None
 
 # Функция для обновления бизнес-метрик
 def update_business_metrics(db: Session):
     """Обновляет бизнес-метрики из БД"""
+    global _business_metrics_updated_at
+    # Импорт внутри функции: metrics не зависит от моделей и БД при загрузке
+    from . import models
+
+    now = time.monotonic()
+    if _business_metrics_updated_at is not None and now - _business_metrics_updated_at < BUSINESS_METRICS_INTERVAL:
+        return
+    _business_metrics_updated_at = now
+
     try:
         # Количество курсов
         courses_count = db.query(models.Course).count()
@@ -136,9 +642,6 @@ def update_business_metrics(db: Session):
         students_count = db.query(models.Student).count()
         students_total.set(students_count)
         
-        # Активные подключения к БД (примерное значение)
-        db_connections_active.set(db.get_bind().pool.checkedout())
-        
     except Exception as e:
         print(f"Error updating business metrics: {e}")
 
@@ -147,6 +650,12 @@ def get_metrics():
     """Возвращает метрики в формате Prometheus"""
     return generate_latest(REGISTRY)
 
+def exposition(accept: str = None):
+    """Метрики и Content-Type по Accept: OpenMetrics (с exemplars) или текстовый формат Prometheus"""
+    if accept and "application/openmetrics-text" in accept:
+        return openmetrics.generate_latest(REGISTRY), openmetrics.CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
 # Функции для инкремента специфичных метрик
 def increment_lesson_completion():
     lesson_completions_total.inc()
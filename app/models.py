@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, UniqueConstraint
+from sqlalchemy import BigInteger, Column, Integer, String, Text, ForeignKey, DateTime, Boolean, LargeBinary, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
+from .budgets import DB_RELATIONSHIP_LAZY as RELATIONSHIP_LAZY
 
 class Course(Base):
     __tablename__ = "courses"
@@ -13,8 +14,8 @@ class Course(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Связи
-    lessons = relationship("Lesson", back_populates="course", cascade="all, delete-orphan")
-    enrollments = relationship("Enrollment", back_populates="course")
+    lessons = relationship("Lesson", back_populates="course", cascade="all, delete-orphan", lazy=RELATIONSHIP_LAZY)
+    enrollments = relationship("Enrollment", back_populates="course", lazy=RELATIONSHIP_LAZY)
 
 class Lesson(Base):
     __tablename__ = "lessons"
@@ -27,9 +28,9 @@ class Lesson(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Связи
-    course = relationship("Course", back_populates="lessons")
-    completions = relationship("LessonCompletion", back_populates="lesson")
-    submissions = relationship("Submission", back_populates="lesson")
+    course = relationship("Course", back_populates="lessons", lazy=RELATIONSHIP_LAZY)
+    completions = relationship("LessonCompletion", back_populates="lesson", lazy=RELATIONSHIP_LAZY)
+    submissions = relationship("Submission", back_populates="lesson", lazy=RELATIONSHIP_LAZY)
 
 class Student(Base):
     __tablename__ = "students"
@@ -40,9 +41,9 @@ class Student(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Связи
-    enrollments = relationship("Enrollment", back_populates="student")
-    completions = relationship("LessonCompletion", back_populates="student")
-    submissions = relationship("Submission", back_populates="student")
+    enrollments = relationship("Enrollment", back_populates="student", lazy=RELATIONSHIP_LAZY)
+    completions = relationship("LessonCompletion", back_populates="student", lazy=RELATIONSHIP_LAZY)
+    submissions = relationship("Submission", back_populates="student", lazy=RELATIONSHIP_LAZY)
 
 class Enrollment(Base):
     __tablename__ = "enrollments"
@@ -56,8 +57,8 @@ class Enrollment(Base):
     __table_args__ = (UniqueConstraint('student_id', 'course_id'),)
     
     # Связи
-    student = relationship("Student", back_populates="enrollments")
-    course = relationship("Course", back_populates="enrollments")
+    student = relationship("Student", back_populates="enrollments", lazy=RELATIONSHIP_LAZY)
+    course = relationship("Course", back_populates="enrollments", lazy=RELATIONSHIP_LAZY)
 
 class LessonCompletion(Base):
     __tablename__ = "lesson_completions"
@@ -72,8 +73,8 @@ class LessonCompletion(Base):
     __table_args__ = (UniqueConstraint('student_id', 'lesson_id'),)
     
     # Связи
-    student = relationship("Student", back_populates="completions")
-    lesson = relationship("Lesson", back_populates="completions")
+    student = relationship("Student", back_populates="completions", lazy=RELATIONSHIP_LAZY)
+    lesson = relationship("Lesson", back_populates="completions", lazy=RELATIONSHIP_LAZY)
 
 class Submission(Base):
     __tablename__ = "submissions"
@@ -87,5 +88,29 @@ class Submission(Base):
     reviewed_at = Column(DateTime(timezone=True))
     
     # Связи
-    student = relationship("Student", back_populates="submissions")
-    lesson = relationship("Lesson", back_populates="submissions")
\ No newline at end of file
+    student = relationship("Student", back_populates="submissions", lazy=RELATIONSHIP_LAZY)
+    lesson = relationship("Lesson", back_populates="submissions", lazy=RELATIONSHIP_LAZY)
+
+class LessonTime(Base):
+    __tablename__ = "lesson_time"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    lesson_id = Column(Integer, ForeignKey("lessons.id"), nullable=False)
+    seconds = Column(BigInteger, nullable=False, default=0)  # суммарное время по heartbeat
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Одна строка на пару студент-урок, heartbeat прибавляют к ней секунды
+    __table_args__ = (UniqueConstraint('student_id', 'lesson_id'),)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # sha256 пути и тела запроса
+    # Сохраненный ответ; status_code NULL - первый запрос с этим ключом еще выполняется
+    status_code = Column(Integer)
+    headers = Column(Text)  # JSON список пар [имя, значение]
+    body = Column(LargeBinary)
+    locked_until = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,169 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from . import metrics, server_timing, tracing
+
+# Настройки пулов соединений из переменных окружения (общие для всех классов маршрутов)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "false").lower() == "true"
+
+# Автоподбор размера пула: только рекомендация в метриках и логе, пул не меняется
+DB_POOL_AUTOTUNE = os.getenv("DB_POOL_AUTOTUNE", "false").lower() == "true"
+DB_POOL_AUTOTUNE_INTERVAL = float(os.getenv("DB_POOL_AUTOTUNE_INTERVAL", "60"))
+DB_POOL_AUTOTUNE_TARGET_WAIT = float(os.getenv("DB_POOL_AUTOTUNE_TARGET_WAIT", "0.005"))
+DB_POOL_AUTOTUNE_HEADROOM = float(os.getenv("DB_POOL_AUTOTUNE_HEADROOM", "1.2"))
+
+
+def engine_options():
+    """Общие параметры create_engine для пулов классов маршрутов"""
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_use_lifo": DB_POOL_USE_LIFO,
+    }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, который измеряет время ожидания соединения.
+
+    Имя класса маршрута передается через pool_logging_name и используется
+    как значение метки route_class.
+    """
+
+    def _do_get(self):
+        route_class = self.logging_name or "default"
+        if self.checkedout() >= self.size() + self._max_overflow and self._max_overflow > -1:
+            # Свободных соединений нет и расти некуда: запрос будет ждать
+            metrics.db_pool_exhausted_total.labels(route_class=route_class).inc()
+        start_time = time.perf_counter()
+        span = tracing.start_span("db.pool.checkout", attributes={"db.pool.route_class": route_class})
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.db_pool_timeouts_total.labels(route_class=route_class).inc()
+            raise
+        finally:
+            wait = time.perf_counter() - start_time
+            metrics.db_pool_wait_seconds.labels(route_class=route_class).observe(wait)
+            server_timing.record_pool_wait(wait)
+            if span is not None:
+                span.end()
+                span.attributes["db.pool.wait_ms"] = round(wait * 1000, 3)
+            tuner = tuners.get(route_class)
+            if tuner is not None:
+                tuner.record_wait(wait)
+
+
+class PoolAutoTuner:
+    """Рекомендует размер пула по закону Литтла и наблюдаемому ожиданию.
+
+    Требуемое число соединений = частота выдачи * среднее время удержания,
+    с запасом DB_POOL_AUTOTUNE_HEADROOM. Если p95 ожидания выше цели,
+    рекомендация не меньше текущей емкости + 1.
+    """
+
+    def __init__(self, route_class: str, pool):
+        self.route_class = route_class
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self._checkouts = 0
+        self._hold_total = 0.0
+        self._window_start = time.monotonic()
+        self.recommended = None
+
+    def record_wait(self, wait: float):
+        with self._lock:
+            self._waits.append(wait)
+
+    def record_hold(self, hold: float):
+        with self._lock:
+            self._checkouts += 1
+            self._hold_total += hold
+            if time.monotonic() - self._window_start < DB_POOL_AUTOTUNE_INTERVAL:
+                return
+            recommended = self._recommend()
+        metrics.db_pool_recommended_size.labels(route_class=self.route_class).set(recommended)
+        capacity = self.pool.size() + self.pool._max_overflow
+        if recommended != self.recommended and recommended != capacity:
+            print(f"Pool autotune [{self.route_class}]: capacity {capacity}, recommended size {recommended}")
+        self.recommended = recommended
+
+    def _recommend(self) -> int:
+        elapsed = time.monotonic() - self._window_start
+        demand = (self._checkouts / elapsed) * (self._hold_total / self._checkouts)
+        recommended = max(1, math.ceil(demand * DB_POOL_AUTOTUNE_HEADROOM))
+        waits = sorted(self._waits)
+        if waits and waits[min(len(waits) - 1, int(len(waits) * 0.95))] > DB_POOL_AUTOTUNE_TARGET_WAIT:
+            recommended = max(recommended, self.pool.size() + self.pool._max_overflow + 1)
+        self._checkouts = 0
+        self._hold_total = 0.0
+        self._waits.clear()
+        self._window_start = time.monotonic()
+        return recommended
+
+
+tuners = {}
+# Все инструментированные пулы (primary и реплики) для общего числа активных соединений
+instrumented_pools = {}
+
+
+def _update_gauges(route_class: str, pool, returning: int = 0):
+    # Событие checkin приходит до возврата соединения в пул, поэтому
+    # возвращаемое соединение вычитается явно
+    metrics.db_pool_checked_out.labels(route_class=route_class).set(pool.checkedout() - returning)
+    metrics.db_pool_overflow.labels(route_class=route_class).set(max(0, pool.overflow()))
+
+
+def _update_active(returning: int = 0):
+    metrics.db_connections_active.set(sum(p.checkedout() for p in instrumented_pools.values()) - returning)
+
+
+def instrument(engine, route_class: str):
+    """Подписывает пул engine на события для живых метрик"""
+    pool = engine.pool
+    instrumented_pools[route_class] = pool
+    if DB_POOL_AUTOTUNE:
+        tuners[route_class] = PoolAutoTuner(route_class, pool)
+    metrics.db_pool_size.labels(route_class=route_class).set(pool.size())
+
+    @event.listens_for(pool, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.db_pool_connects_total.labels(route_class=route_class).inc()
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_time"] = time.perf_counter()
+        _update_gauges(route_class, pool)
+        _update_active()
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checkout_time = connection_record.info.pop("checkout_time", None)
+        if checkout_time is not None:
+            hold = time.perf_counter() - checkout_time
+            metrics.db_connection_hold_seconds.labels(route_class=route_class).observe(hold)
+            tuner = tuners.get(route_class)
+            if tuner is not None:
+                tuner.record_hold(hold)
+        _update_gauges(route_class, pool, returning=1)
+        _update_active(returning=1)
+
+    @event.listens_for(pool, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.db_pool_invalidations_total.labels(route_class=route_class, soft="false").inc()
+
+    @event.listens_for(pool, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        metrics.db_pool_invalidations_total.labels(route_class=route_class, soft="true").inc()
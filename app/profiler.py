@@ -0,0 +1,219 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from . import loop_monitor, metrics
+
+# Статистический профилировщик: поток раз в интервал снимает стеки всех потоков
+# через sys._current_frames() и считает одинаковые стеки. Время - по стенным
+# часам: ожидание ответа БД тоже попадает в профиль, а ожидание работы
+# (пустой event loop, свободные потоки пула) отбрасывается. Корень стека -
+# маршрут запроса (по ASGI scope или по функции маршрута в стеке) или имя потока.
+# GET /admin/profile?seconds=N снимает профиль по запросу; непрерывный режим
+# пишет профили в PROFILER_DIR каждые PROFILER_ROTATE_SECONDS секунд.
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILER_CONTINUOUS = os.getenv("PROFILER_CONTINUOUS", "false").lower() == "true"
+PROFILER_CONTINUOUS_INTERVAL_MS = float(os.getenv("PROFILER_CONTINUOUS_INTERVAL_MS", "50"))
+# Доля времени одного ядра на снятие стеков; интервал растет, если сэмпл дороже
+PROFILER_CONTINUOUS_OVERHEAD = float(os.getenv("PROFILER_CONTINUOUS_OVERHEAD", "0.01"))
+PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+PROFILER_ROTATE_SECONDS = float(os.getenv("PROFILER_ROTATE_SECONDS", "60"))
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", "60"))
+
+FORMATS = ("collapsed", "speedscope")
+_STACK_LIMIT = 128
+
+# Кадры, в которых поток ждет работы, а не выполняет ее
+_IDLE_FRAMES = {
+    ("threading", "Condition.wait"),
+    ("selectors", "EpollSelector.select"),
+    ("selectors", "KqueueSelector.select"),
+    ("selectors", "PollSelector.select"),
+    ("selectors", "SelectSelector.select"),
+}
+
+
+class Profile:
+    """Счетчики стеков: ключ - кортеж имен кадров от корня (маршрут или поток) к листу"""
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self.seconds = 0.0
+        self.samples = 0
+        self.stacks = Counter()
+
+    def collapsed(self) -> str:
+        """Формат collapsed stacks (flamegraph.pl, speedscope, inferno)"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self) -> dict:
+        """Формат speedscope: по профилю на маршрут или поток, вес - миллисекунды"""
+        # Вес сэмпла - средний фактический интервал между сэмплами
+        sample_ms = self.seconds * 1000 / self.samples if self.samples else 0.0
+        frames, frame_index, profiles = [], {}, {}
+        for stack, count in self.stacks.most_common():
+            root, *calls = stack
+            indexes = []
+            for name in calls:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indexes.append(frame_index[name])
+            profile = profiles.setdefault(root, {
+                "type": "sampled", "name": root, "unit": "milliseconds",
+                "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+            })
+            weight = round(count * sample_ms, 3)
+            profile["samples"].append(indexes)
+            profile["weights"].append(weight)
+            profile["endValue"] += weight
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"learntracker {self.started_at.isoformat()}",
+            "exporter": "learntracker.profiler",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+    def render(self, output: str):
+        if output == "speedscope":
+            return json.dumps(self.speedscope(), separators=(",", ":"))
+        return self.collapsed()
+
+
+class Sampler:
+    """Снятие стеков всех потоков, кроме собственного"""
+
+    def __init__(self, routes):
+        # Функции маршрутов: синхронные маршруты выполняются в пуле потоков, где scope нет
+        self._route_codes = {}
+        for route in routes:
+            code = getattr(getattr(route, "endpoint", None), "__code__", None)
+            if code is not None and hasattr(route, "path_format"):
+                self._route_codes[code] = route.path_format
+        self._labels = {}
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+            self._labels[code] = label
+        return label
+
+    def _idle(self, frame) -> bool:
+        return (frame.f_globals.get("__name__"), frame.f_code.co_qualname) in _IDLE_FRAMES
+
+    def sample(self, profile: Profile):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own or self._idle(frame):
+                continue
+            calls, route, leaf = [], None, frame
+            while frame is not None and len(calls) < _STACK_LIMIT:
+                calls.append(self._label(frame))
+                if route is None:
+                    route = self._route_codes.get(frame.f_code)
+                frame = frame.f_back
+            if route is None:
+                # Вне функции маршрута маршрут берется из scope; f_locals дороже
+                route = loop_monitor.frame_endpoint(leaf)
+            del frame, leaf
+            if route == loop_monitor.UNKNOWN_ENDPOINT:
+                root = f"thread {names.get(ident, ident)}"
+            elif route == metrics.UNMATCHED_ENDPOINT:
+                # Middleware до выбора маршрута
+                root = "middleware"
+            else:
+                root = f"route {route}"
+            calls.append(root)
+            calls.reverse()
+            profile.stacks[tuple(calls)] += 1
+        profile.samples += 1
+
+
+def collect(routes, seconds: float, interval: float = PROFILE_INTERVAL_MS / 1000) -> Profile:
+    """Профиль за seconds секунд (блокирует вызывающий поток)"""
+    sampler = Sampler(routes)
+    profile = Profile()
+    start_time = time.monotonic()
+    deadline = start_time + seconds
+    next_sample = start_time
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            profile.seconds = now - start_time
+            return profile
+        if now < next_sample:
+            time.sleep(min(next_sample, deadline) - now)
+            continue
+        sampler.sample(profile)
+        next_sample += interval
+
+
+class ContinuousProfiler:
+    """Поток, который постоянно снимает стеки и пишет профиль в файл раз в rotate секунд"""
+
+    def __init__(self, interval: float = PROFILER_CONTINUOUS_INTERVAL_MS / 1000,
+                 overhead: float = PROFILER_CONTINUOUS_OVERHEAD, directory: str = PROFILER_DIR,
+                 rotate: float = PROFILER_ROTATE_SECONDS, keep: int = PROFILER_KEEP):
+        self.interval = interval
+        self.overhead = overhead
+        self.directory = directory
+        self.rotate = rotate
+        self.keep = keep
+        self.routes = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _write(self, profile: Profile, start_time: float):
+        profile.seconds = time.monotonic() - start_time
+        name = f"profile-{profile.started_at.strftime('%Y%m%dT%H%M%SZ')}.collapsed"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), "w", encoding="utf-8") as profile_file:
+                profile_file.write(profile.collapsed())
+            files = sorted(f for f in os.listdir(self.directory) if f.startswith("profile-"))
+            for old in files[:-self.keep]:
+                os.remove(os.path.join(self.directory, old))
+        except OSError as e:
+            print(f"Error writing profile: {e}")
+
+    def _run(self):
+        sampler = Sampler(self.routes)
+        profile, profile_start = Profile(), time.monotonic()
+        wait = self.interval
+        while not self._stop.wait(wait):
+            start_time = time.perf_counter()
+            sampler.sample(profile)
+            cost = time.perf_counter() - start_time
+            # Дорогой сэмпл (много потоков, глубокие стеки) - реже сэмплируем
+            wait = max(self.interval, cost / self.overhead)
+            if time.monotonic() - profile_start >= self.rotate:
+                self._write(profile, profile_start)
+                profile, profile_start = Profile(), time.monotonic()
+        if profile.samples:
+            self._write(profile, profile_start)
+
+    def start(self, routes):
+        if self._thread is None:
+            self.routes = routes
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Записывает текущий профиль и останавливает поток"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+
+continuous = ContinuousProfiler()
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from sqlalchemy import event
+
+from . import budgets, metrics, slow_queries, tracing
+
+# Метрики на уровне SQL запросов: события engine before/after_cursor_execute
+# считают каждый запрос к БД с меткой операции (функции crud/reads, в которой он
+# выполнен) и отпечатка запроса - SQL без значений параметров и литералов.
+# Число отпечатков ограничено: новые сверх лимита попадают в "other".
+DB_QUERY_FINGERPRINTS_MAX = int(os.getenv("DB_QUERY_FINGERPRINTS_MAX", "500"))
+
+UNATTRIBUTED = "other"
+OVERFLOW_FINGERPRINT = "other"
+_STATEMENT_CACHE_MAX = 5000
+_INFO_STATEMENT_MAX = 300
+
+current_operation: ContextVar[str] = ContextVar("current_operation", default=UNATTRIBUTED)
+
+
+@contextmanager
+def operation(name: str):
+    """Запросы внутри блока считаются с меткой operation=name"""
+    token = current_operation.set(name)
+    try:
+        yield
+    finally:
+        current_operation.reset(token)
+
+
+def tracked(func):
+    """Декоратор для функций crud/reads: метка operation - имя функции.
+
+    Вложенный вызов (complete_lesson -> add_lesson_completion) остается
+    на счету внешней функции, но получает свой span трассировки.
+    """
+    name = func.__name__
+    span_name = f"{func.__module__.rsplit('.', 1)[-1]}.{name}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracing.span(span_name):
+            if current_operation.get() != UNATTRIBUTED:
+                return func(*args, **kwargs)
+            with operation(name):
+                return func(*args, **kwargs)
+
+    return wrapper
+
+
+_WHITESPACE = re.compile(r"\s+")
+# Строки, числа и плейсхолдеры параметров (%(name)s, %s, $1) -> ?
+_VALUES = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b")
+# Списки значений разной длины (IN, VALUES нескольких строк) дают один отпечаток
+_VALUE_LIST = re.compile(r"\?(?:, \?)+")
+_ROW_LIST = re.compile(r"(\(\?(?:, \.\.\.)?\))(?:, \(\?(?:, \.\.\.)?\))+")
+
+
+def normalize(statement: str) -> str:
+    normalized = _VALUES.sub("?", _WHITESPACE.sub(" ", statement).strip())
+    normalized = _VALUE_LIST.sub("?, ...", normalized)
+    return _ROW_LIST.sub(r"\1, ...", normalized)
+
+
+class QueryStats:
+    """Отпечатки запросов и заранее созданные дочерние метрики"""
+
+    def __init__(self, max_fingerprints: int = DB_QUERY_FINGERPRINTS_MAX):
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints = {}
+        self._known = set()
+        self._children = {}
+
+    def fingerprint(self, statement: str) -> str:
+        fingerprint = self._fingerprints.get(statement)
+        if fingerprint is not None:
+            return fingerprint
+        normalized = normalize(statement)
+        fingerprint = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+        if fingerprint not in self._known:
+            if len(self._known) >= self.max_fingerprints:
+                fingerprint = OVERFLOW_FINGERPRINT
+            else:
+                self._known.add(fingerprint)
+                metrics.db_statement_info.labels(
+                    fingerprint=fingerprint, statement=normalized[:_INFO_STATEMENT_MAX]
+                ).set(1)
+        if len(self._fingerprints) >= _STATEMENT_CACHE_MAX:
+            self._fingerprints.clear()
+        self._fingerprints[statement] = fingerprint
+        return fingerprint
+
+    def children(self, operation_name: str, fingerprint: str):
+        key = (operation_name, fingerprint)
+        children = self._children.get(key)
+        if children is None:
+            children = self._children[key] = (
+                metrics.db_queries_total.labels(operation=operation_name, fingerprint=fingerprint),
+                metrics.db_query_duration_seconds.labels(operation=operation_name, fingerprint=fingerprint),
+                metrics.db_rows_returned_total.labels(operation=operation_name, fingerprint=fingerprint),
+            )
+        return children
+
+
+stats = QueryStats()
+
+
+def sqlstate(exception) -> str:
+    """SQLSTATE исключения драйвера: psycopg2 - pgcode, psycopg 3 - sqlstate"""
+    return getattr(exception, "pgcode", None) or getattr(exception, "sqlstate", None) or ""
+
+
+def instrument(engine):
+    """Подписывает engine на события выполнения запросов"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start_time = time.perf_counter()
+        context._trace_span = tracing.start_span("db.query", tracing.CLIENT)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._query_start_time
+        fingerprint = stats.fingerprint(statement)
+        counter, histogram, rows = stats.children(current_operation.get(), fingerprint)
+        counter.inc()
+        histogram.observe(duration)
+        # rowcount для SELECT - число строк результата (курсор на стороне клиента)
+        if cursor.description is not None and cursor.rowcount > 0:
+            rows.inc(cursor.rowcount)
+        span = context._trace_span
+        if span is not None:
+            span.end()
+            span.attributes.update({
+                "db.system": "postgresql",
+                "db.operation": current_operation.get(),
+                "db.fingerprint": fingerprint,
+                "db.statement": statement[:_INFO_STATEMENT_MAX],
+                "db.rows": cursor.rowcount,
+            })
+        if duration >= slow_queries.THRESHOLD:
+            slow_queries.log.record(statement, parameters, executemany, duration, fingerprint, current_operation.get())
+        # Последним: в режиме QUERY_BUDGET_MODE=raise может бросить исключение
+        budgets.record(fingerprint, duration)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # Только ошибки драйвера/БД, а не исключения слушателей (например, бюджет запросов)
+        if exception_context.statement is None or exception_context.sqlalchemy_exception is None:
+            return
+        code = sqlstate(exception_context.original_exception)
+        error = code or type(exception_context.original_exception).__name__
+        metrics.db_query_errors_total.labels(
+            operation=current_operation.get(), sqlstate_class=code[:2] or "none"
+        ).inc()
+        context = exception_context.execution_context
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.end()
+            span.error = error
+            span.attributes.update({
+                "db.system": "postgresql",
+                "db.operation": current_operation.get(),
+                "db.statement": exception_context.statement[:_INFO_STATEMENT_MAX],
+            })
+        # Запрос, отмененный по statement_timeout, тоже медленный
+        start_time = getattr(context, "_query_start_time", None)
+        if start_time is not None:
+            duration = time.perf_counter() - start_time
+            if duration >= slow_queries.THRESHOLD:
+                slow_queries.log.record(
+                    exception_context.statement, exception_context.parameters, context.executemany,
+                    duration, stats.fingerprint(exception_context.statement), current_operation.get(),
+                    error=error,
+                )
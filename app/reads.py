@@ -0,0 +1,124 @@
+from sqlalchemy import Float, bindparam, cast, func, select
+from sqlalchemy.orm import Session
+from typing import Optional
+import time
+
+from . import models, queries, schemas
+from .serialization import field_names
+
+# Чтения для GET эндпоинтов на SQLAlchemy Core.
+#
+# Запросы выбирают колонки таблиц в порядке полей схемы ответа и возвращают
+# строки (кортежи), которые serialization переводит в байты без ORM-объектов,
+# identity map и отслеживания изменений. Запросы собраны один раз при импорте,
+# параметры передаются через bindparam, поэтому ключ кеша и скомпилированный
+# SQL переиспользуются между запросами.
+
+def _columns(model, schema):
+    table = model.__table__
+    return [table.c[name] for name in field_names(schema)]
+
+_course = models.Course.__table__.c
+_lesson = models.Lesson.__table__.c
+_student = models.Student.__table__.c
+_enrollment = models.Enrollment.__table__.c
+_completion = models.LessonCompletion.__table__.c
+
+COURSES_SQL = (
+    select(*_columns(models.Course, schemas.Course))
+    .offset(bindparam("skip"))
+    .limit(bindparam("limit"))
+)
+
+COURSE_SQL = select(*_columns(models.Course, schemas.Course)).where(_course.id == bindparam("course_id"))
+
+COURSE_EXISTS_SQL = select(_course.id).where(_course.id == bindparam("course_id"))
+
+COURSE_LESSONS_SQL = (
+    select(*_columns(models.Lesson, schemas.Lesson))
+    .where(_lesson.course_id == bindparam("course_id"))
+    .order_by(_lesson.order_num)
+)
+
+SUBMISSIONS_SQL = (
+    select(*_columns(models.Submission, schemas.Submission))
+    .offset(bindparam("skip"))
+    .limit(bindparam("limit"))
+)
+
+COURSE_ANALYTICS_SQL = (
+    select(
+        _course.id.label("course_id"),
+        _course.title.label("course_title"),
+        func.count(_enrollment.id).label("total_students"),
+        func.count(_completion.id).label("completed_lessons"),
+        # Нулевое среднее - null, как в прежнем ответе (float(avg) if avg else None)
+        cast(func.nullif(func.avg(_completion.time_spent), 0), Float).label("avg_completion_time"),
+    )
+    .select_from(models.Course.__table__)
+    .outerjoin(models.Enrollment.__table__, _course.id == _enrollment.course_id)
+    .outerjoin(models.Lesson.__table__, _course.id == _lesson.course_id)
+    .outerjoin(models.LessonCompletion.__table__, _lesson.id == _completion.lesson_id)
+    .group_by(_course.id, _course.title)
+)
+
+# Прогресс студента одним запросом: имя и три счетчика скалярными подзапросами
+_student_id = bindparam("student_id")
+STUDENT_PROGRESS_SQL = select(
+    _student.name,
+    select(func.count()).select_from(models.Enrollment.__table__)
+    .where(_enrollment.student_id == _student_id).scalar_subquery(),
+    select(func.count()).select_from(models.LessonCompletion.__table__)
+    .where(_completion.student_id == _student_id).scalar_subquery(),
+    select(func.count()).select_from(models.Lesson.__table__)
+    .join(models.Enrollment.__table__, _lesson.course_id == _enrollment.course_id)
+    .where(_enrollment.student_id == _student_id).scalar_subquery(),
+).where(_student.id == _student_id)
+
+
+@queries.tracked
+def get_courses(db: Session, skip: int = 0, limit: int = 100):
+    return db.execute(COURSES_SQL, {"skip": skip, "limit": limit}).all()
+
+@queries.tracked
+def get_course(db: Session, course_id: int):
+    return db.execute(COURSE_SQL, {"course_id": course_id}).first()
+
+@queries.tracked
+def course_exists(db: Session, course_id: int) -> bool:
+    return db.execute(COURSE_EXISTS_SQL, {"course_id": course_id}).first() is not None
+
+@queries.tracked
+def get_course_lessons(db: Session, course_id: int):
+    return db.execute(COURSE_LESSONS_SQL, {"course_id": course_id}).all()
+
+@queries.tracked
+def get_submissions(db: Session, skip: int = 0, limit: int = 100):
+    return db.execute(SUBMISSIONS_SQL, {"skip": skip, "limit": limit}).all()
+
+# Аналитика (медленные запросы для тестирования алертов)
+@queries.tracked
+def get_course_analytics(db: Session):
+    """Сложный запрос для аналитики курсов - будет медленным при нагрузке"""
+    time.sleep(0.1)  # Искусственная задержка для демонстрации
+    return db.execute(COURSE_ANALYTICS_SQL).all()
+
+@queries.tracked
+def get_student_progress(db: Session, student_id: int) -> Optional[schemas.StudentProgress]:
+    """Прогресс конкретного студента, None - студента нет"""
+    time.sleep(0.05)  # Небольшая задержка
+
+    row = db.execute(STUDENT_PROGRESS_SQL, {"student_id": student_id}).first()
+    if row is None:
+        return None
+    student_name, enrollments_count, completed_lessons, total_lessons = row
+
+    completion_percentage = (completed_lessons / total_lessons * 100) if total_lessons > 0 else 0
+
+    return schemas.StudentProgress(
+        student_id=student_id,
+        student_name=student_name,
+        total_enrollments=enrollments_count,
+        completed_lessons=completed_lessons,
+        completion_percentage=round(completion_percentage, 2)
+    )
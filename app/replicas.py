@@ -0,0 +1,144 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import create_engine, text
+
+from . import metrics, pool, queries, route_classes
+
+# Реплики для чтения: список host:port через запятую, остальные параметры как у primary.
+# Пусто - все запросы идут в primary.
+POSTGRES_REPLICA_HOSTS = os.getenv("POSTGRES_REPLICA_HOSTS", "")
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "2.0"))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "1.0"))
+# Окно read-your-writes: после записи клиент читает из primary
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5.0"))
+DB_STICKY_CLIENTS_MAX = int(os.getenv("DB_STICKY_CLIENTS_MAX", "100000"))
+
+# Классы маршрутов, которые можно обслуживать с реплик
+READ_CLASSES = (route_classes.INTERACTIVE_READ, route_classes.ANALYTICS)
+
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    """Реплика: пулы для классов чтения и последнее измеренное отставание"""
+
+    def __init__(self, name: str, url: str, pool_settings, engine_options):
+        self.name = name
+        self.lag = None
+        self.healthy = False
+        self.engines = {}
+        for route_class in READ_CLASSES:
+            pool_size, max_overflow = pool_settings(route_class)
+            logging_name = f"{route_class}@{name}"
+            self.engines[route_class] = create_engine(
+                url,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_logging_name=logging_name,
+                **engine_options(),
+            )
+            pool.instrument(self.engines[route_class], logging_name)
+            queries.instrument(self.engines[route_class])
+        # Отдельное соединение для проверки отставания, чтобы не занимать рабочие пулы
+        self._monitor_engine = create_engine(url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+
+    def check_lag(self):
+        try:
+            with self._monitor_engine.connect() as connection:
+                self.lag = float(connection.execute(REPLICA_LAG_SQL).scalar())
+            self.healthy = self.lag <= DB_REPLICA_MAX_LAG
+        except Exception as e:
+            print(f"Replica {self.name} lag check failed: {e}")
+            self.lag = None
+            self.healthy = False
+        metrics.db_replica_lag_seconds.labels(replica=self.name).set(self.lag if self.lag is not None else -1)
+        metrics.db_replica_healthy.labels(replica=self.name).set(1 if self.healthy else 0)
+
+
+class ReplicaRouter:
+    """Выбор реплики для чтения с учетом отставания и read-your-writes"""
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._round_robin = itertools.cycle(range(len(replicas))) if replicas else None
+        self._recent_writers = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def mark_write(self, client_id: str):
+        """Запоминает запись клиента: его чтения некоторое время идут в primary"""
+        if not self.replicas or not client_id:
+            return
+        with self._lock:
+            self._recent_writers[client_id] = time.monotonic() + DB_READ_YOUR_WRITES_WINDOW
+            self._recent_writers.move_to_end(client_id)
+            while len(self._recent_writers) > DB_STICKY_CLIENTS_MAX:
+                self._recent_writers.popitem(last=False)
+
+    def _is_sticky(self, client_id: Optional[str]) -> bool:
+        if not client_id:
+            return False
+        with self._lock:
+            expires_at = self._recent_writers.get(client_id)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._recent_writers[client_id]
+                return False
+            return True
+
+    def choose(self, route_class: str, client_id: Optional[str]):
+        """Возвращает engine реплики или None, если читать нужно из primary"""
+        if not self.replicas or route_class not in READ_CLASSES:
+            return None
+        if self._is_sticky(client_id):
+            metrics.db_reads_routed_total.labels(target="primary", reason="read_your_writes").inc()
+            return None
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[next(self._round_robin)]
+                if replica.healthy:
+                    metrics.db_reads_routed_total.labels(target="replica", reason="ok").inc()
+                    return replica.engines[route_class]
+        metrics.db_reads_routed_total.labels(target="primary", reason="replica_lag").inc()
+        return None
+
+    def check_all(self):
+        for replica in self.replicas:
+            replica.check_lag()
+
+    def start(self):
+        """Запускает фоновую проверку отставания реплик"""
+        if not self.replicas or self._thread is not None:
+            return
+        self.check_all()
+
+        def run():
+            while not self._stop.wait(DB_REPLICA_LAG_CHECK_INTERVAL):
+                self.check_all()
+
+        self._thread = threading.Thread(target=run, name="replica-lag-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=DB_REPLICA_LAG_CHECK_INTERVAL * 2)
+            self._thread = None
+
+
+def build_router(url_for_host, pool_settings, engine_options) -> ReplicaRouter:
+    replicas = []
+    for host in filter(None, (item.strip() for item in POSTGRES_REPLICA_HOSTS.split(","))):
+        replicas.append(Replica(host, url_for_host(host), pool_settings, engine_options))
+    return ReplicaRouter(replicas)
@@ -0,0 +1,38 @@
+import re
+
+# Классы маршрутов: у каждого свой пул соединений (bulkhead) и лимит конкурентности,
+# чтобы всплеск аналитики не отнимал ресурсы у интерактивных запросов и записей
+INTERACTIVE_READ = "interactive-read"
+WRITE = "write"
+ANALYTICS = "analytics"
+ADMIN = "admin"
+
+ROUTE_CLASSES = (INTERACTIVE_READ, WRITE, ANALYTICS, ADMIN)
+
+# Маршруты без обращения к БД: heartbeat копится в памяти (heartbeats.py), его
+# перегрузку ограничивает сам агрегатор. Лимит класса WRITE и дедлайн им не нужны,
+# а всплеск heartbeat иначе занимал бы очередь записей
+IN_MEMORY_ROUTES = (
+    ("POST", re.compile(r"^/api/v1/lessons/[^/]+/heartbeat$")),
+)
+
+
+def classify(method: str, path: str) -> str:
+    """Определяет класс маршрута по методу и пути запроса"""
+    if path.startswith("/api/v1/analytics"):
+        return ANALYTICS
+    if not path.startswith("/api/"):
+        return ADMIN
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return INTERACTIVE_READ
+    return WRITE
+
+
+def in_memory(method: str, path: str) -> bool:
+    """Маршрут не обращается к БД и обходит admission control и дедлайны"""
+    return any(method == route_method and pattern.match(path) for route_method, pattern in IN_MEMORY_ROUTES)
+
+
+def env_name(route_class: str) -> str:
+    """Имя класса для переменных окружения: interactive-read -> INTERACTIVE_READ"""
+    return route_class.replace("-", "_").upper()
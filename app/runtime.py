@@ -0,0 +1,122 @@
+import asyncio
+import gc
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from anyio import to_thread
+
+from . import metrics
+
+# Состояние интерпретатора: паузы GC (callback в gc.callbacks), потоки, занятость
+# пула потоков и число задач asyncio (обновляются перед экспортом /metrics).
+# При TRACEMALLOC_ENABLED tracemalloc отслеживает выделения памяти с момента
+# старта; снимки и разница между ними доступны в /admin/tracemalloc/*. Трассировка
+# выделений замедляет код заметно, поэтому по умолчанию выключена.
+TRACEMALLOC_ENABLED = os.getenv("TRACEMALLOC_ENABLED", "false").lower() == "true"
+# Глубина стека у каждого выделения (для group_by=traceback нужно больше 1)
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "1"))
+TRACEMALLOC_SNAPSHOTS = int(os.getenv("TRACEMALLOC_SNAPSHOTS", "5"))
+
+GROUP_BY = ("lineno", "filename", "traceback")
+
+# Выделения самого tracemalloc и импорта модулей не интересны
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def update_metrics():
+    """Потоки, пул потоков и задачи asyncio (вызывается в event loop перед экспортом)"""
+    metrics.threads.set(threading.active_count())
+    limiter = to_thread.current_default_thread_limiter()
+    metrics.threadpool_busy.set(limiter.borrowed_tokens)
+    metrics.threadpool_limit.set(limiter.total_tokens)
+    metrics.asyncio_tasks.set(len(asyncio.all_tasks()))
+    if tracemalloc.is_tracing():
+        metrics.tracemalloc_traced_bytes.set(tracemalloc.get_traced_memory()[0])
+
+
+def _statistic(statistic, group_by: str) -> dict:
+    if group_by == "traceback":
+        location = [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback]
+    else:
+        frame = statistic.traceback[0]
+        location = frame.filename if group_by == "filename" else f"{frame.filename}:{frame.lineno}"
+    result = {"location": location, "size_bytes": statistic.size, "count": statistic.count}
+    if hasattr(statistic, "size_diff"):
+        result["size_diff_bytes"] = statistic.size_diff
+        result["count_diff"] = statistic.count_diff
+    return result
+
+
+class AllocationSnapshots:
+    """Последние снимки tracemalloc по номерам"""
+
+    def __init__(self, keep: int = TRACEMALLOC_SNAPSHOTS):
+        self.keep = keep
+        self._snapshots = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def take(self) -> dict:
+        """Новый снимок; старые сверх keep удаляются"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        traced, peak = tracemalloc.get_traced_memory()
+        summary = {
+            "id": None,
+            "time": datetime.now(timezone.utc).isoformat(),
+            "traced_bytes": traced,
+            "peak_bytes": peak,
+        }
+        with self._lock:
+            summary["id"] = self._next_id
+            self._next_id += 1
+            self._snapshots[summary["id"]] = (summary, snapshot)
+            while len(self._snapshots) > self.keep:
+                self._snapshots.popitem(last=False)
+        return summary
+
+    def summaries(self) -> list:
+        with self._lock:
+            return [summary for summary, _ in self._snapshots.values()]
+
+    def _get(self, snapshot_id: int):
+        with self._lock:
+            item = self._snapshots.get(snapshot_id)
+        return item[1] if item is not None else None
+
+    def top(self, snapshot_id: int, group_by: str, limit: int) -> Optional[list]:
+        """Крупнейшие места выделения памяти в снимке; None - снимка нет"""
+        snapshot = self._get(snapshot_id)
+        if snapshot is None:
+            return None
+        return [_statistic(statistic, group_by) for statistic in snapshot.statistics(group_by)[:limit]]
+
+    def diff(self, base_id: int, target_id: int, group_by: str, limit: int) -> Optional[list]:
+        """Места с наибольшим ростом памяти от base к target; None - снимка нет"""
+        base, target = self._get(base_id), self._get(target_id)
+        if base is None or target is None:
+            return None
+        return [_statistic(statistic, group_by) for statistic in target.compare_to(base, group_by)[:limit]]
+
+
+snapshots = AllocationSnapshots()
+
+
+def start():
+    if metrics.gc_pauses.callback not in gc.callbacks:
+        gc.callbacks.append(metrics.gc_pauses.callback)
+    if TRACEMALLOC_ENABLED and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def stop():
+    if metrics.gc_pauses.callback in gc.callbacks:
+        gc.callbacks.remove(metrics.gc_pauses.callback)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from typing import List, Optional
 
@@ -51,6 +51,10 @@ class LessonCompletionCreate(BaseModel):
     student_id: int
     time_spent: Optional[int] = None
 
+class LessonHeartbeat(BaseModel):
+    student_id: int
+    seconds: int = Field(gt=0)  # время на уроке с предыдущего heartbeat
+
 class SubmissionCreate(BaseModel):
     student_id: int
     lesson_id: int
@@ -0,0 +1,178 @@
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, Callable, Iterable, List, Optional, Type
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
+
+from . import server_timing
+
+try:
+    import msgpack
+except ImportError:  # MessagePack необязателен: без него отдаем только JSON
+    msgpack = None
+
+# Быстрая сериализация ответов для GET эндпоинтов.
+#
+# Строки из БД считаются доверенными: повторная валидация через response_model
+# (from_attributes) пропускается, поля читаются напрямую и сразу переводятся
+# в байты закешированным TypeAdapter (pydantic-core, без json.dumps).
+# response_model у роутов остается, поэтому OpenAPI схема не меняется.
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.learntracker.columnar+json"
+COLUMNAR_MSGPACK_MEDIA_TYPE = "application/vnd.learntracker.columnar+msgpack"
+
+# Форматы списков в порядке предпочтения сервера при равном q
+LIST_MEDIA_TYPES = [JSON_MEDIA_TYPE, COLUMNAR_JSON_MEDIA_TYPE]
+if msgpack is not None:
+    LIST_MEDIA_TYPES += [MSGPACK_MEDIA_TYPE, COLUMNAR_MSGPACK_MEDIA_TYPE]
+
+# Дополнительные типы ответа для OpenAPI у списочных эндпоинтов
+LIST_RESPONSES = {
+    200: {
+        "description": "Список объектов. Формат выбирается по заголовку Accept: "
+                       "строки (JSON или MessagePack) либо колоночный вид "
+                       "{\"columns\": [...], \"data\": {колонка: [значения]}}",
+        "content": {media_type: {} for media_type in LIST_MEDIA_TYPES[1:]},
+    }
+}
+
+@lru_cache(maxsize=None)
+def field_names(model: Type[BaseModel]) -> tuple:
+    return tuple(model.model_fields)
+
+@lru_cache(maxsize=None)
+def _getter(model: Type[BaseModel]) -> Callable[[Any], tuple]:
+    names = field_names(model)
+    getter = attrgetter(*names)
+    if len(names) == 1:
+        return lambda obj: (getter(obj),)
+    return getter
+
+@lru_cache(maxsize=None)
+def _row_type(model: Type[BaseModel]) -> type:
+    # TypedDict с теми же аннотациями, что и у схемы: сериализатор знает типы
+    # полей заранее и не выводит их для каждого значения
+    fields = {name: field.annotation for name, field in model.model_fields.items()}
+    return TypedDict(f"{model.__name__}Row", fields)
+
+@lru_cache(maxsize=None)
+def _columnar_type(model: Type[BaseModel]) -> type:
+    columns = {name: List[field.annotation] for name, field in model.model_fields.items()}
+    data = TypedDict(f"{model.__name__}Columns", columns)
+    return TypedDict(f"{model.__name__}Columnar", {"columns": List[str], "data": data})
+
+@lru_cache(maxsize=None)
+def get_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(_row_type(model))
+
+@lru_cache(maxsize=None)
+def get_list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[_row_type(model)])
+
+@lru_cache(maxsize=None)
+def get_columnar_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(_columnar_type(model))
+
+def _is_row(model: Type[BaseModel], obj: Any) -> bool:
+    # Строка Core из reads с колонками в порядке полей схемы уже кортеж значений
+    return getattr(obj, "_fields", None) == field_names(model)
+
+def to_row(model: Type[BaseModel], obj: Any) -> dict:
+    """Достает поля схемы из ORM-объекта или строки без валидации"""
+    if _is_row(model, obj):
+        return dict(zip(field_names(model), obj))
+    return dict(zip(field_names(model), _getter(model)(obj)))
+
+def _values(model: Type[BaseModel], objs: Iterable[Any]) -> list:
+    objs = list(objs)
+    if objs and _is_row(model, objs[0]):
+        return objs
+    getter = _getter(model)
+    return [getter(obj) for obj in objs]
+
+def to_rows(model: Type[BaseModel], objs: Iterable[Any]) -> List[dict]:
+    names = field_names(model)
+    return [dict(zip(names, values)) for values in _values(model, objs)]
+
+def to_columns(model: Type[BaseModel], objs: Iterable[Any]) -> dict:
+    """Колоночный вид: имена полей один раз, значения списками по колонкам"""
+    names = field_names(model)
+    values = _values(model, objs)
+    columns = zip(*values) if values else [()] * len(names)
+    return {"columns": list(names), "data": dict(zip(names, map(list, columns)))}
+
+def dump_json(model: Type[BaseModel], obj: Any) -> bytes:
+    return get_adapter(model).dump_json(to_row(model, obj))
+
+def dump_json_many(model: Type[BaseModel], objs: Iterable[Any]) -> bytes:
+    return get_list_adapter(model).dump_json(to_rows(model, objs))
+
+@lru_cache(maxsize=256)
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Выбирает формат списка по заголовку Accept; None - ни один формат не принимается.
+
+    Без заголовка (или с пустым) - JSON. q=0 означает отказ от формата, явно
+    указанный тип важнее application/*, а тот важнее */*.
+    """
+    if not accept or not accept.strip():
+        return JSON_MEDIA_TYPE
+    explicit, wildcards = {}, {}
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        media_type = media_type.lower()
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in ("*/*", "application/*"):
+            wildcards[media_type] = max(q, wildcards.get(media_type, 0.0))
+        elif media_type:
+            explicit[media_type] = max(q, explicit.get(media_type, 0.0))
+    best, best_q = None, 0.0
+    for media_type in LIST_MEDIA_TYPES:
+        q = explicit.get(media_type, wildcards.get("application/*", wildcards.get("*/*", 0.0)))
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+def dump_list(model: Type[BaseModel], objs: Iterable[Any], media_type: str) -> bytes:
+    if media_type == COLUMNAR_JSON_MEDIA_TYPE:
+        return get_columnar_adapter(model).dump_json(to_columns(model, objs))
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(get_list_adapter(model).dump_python(to_rows(model, objs), mode="json"))
+    if media_type == COLUMNAR_MSGPACK_MEDIA_TYPE:
+        columns = get_columnar_adapter(model).dump_python(to_columns(model, objs), mode="json")
+        return msgpack.packb(columns)
+    return dump_json_many(model, objs)
+
+def json_response(model: Type[BaseModel], obj: Any) -> Response:
+    """Ответ с одним объектом, сериализованным напрямую в байты"""
+    with server_timing.serializing():
+        content = dump_json(model, obj)
+    return Response(content=content, media_type=JSON_MEDIA_TYPE)
+
+def json_list_response(model: Type[BaseModel], objs: Iterable[Any]) -> Response:
+    """Ответ со списком объектов, сериализованным напрямую в байты"""
+    with server_timing.serializing():
+        content = dump_json_many(model, objs)
+    return Response(content=content, media_type=JSON_MEDIA_TYPE)
+
+def list_response(model: Type[BaseModel], objs: Iterable[Any], accept: Optional[str] = None) -> Response:
+    """Ответ со списком в формате, согласованном по заголовку Accept"""
+    media_type = negotiate(accept)
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Supported media types: {', '.join(LIST_MEDIA_TYPES)}")
+    with server_timing.serializing():
+        content = dump_list(model, objs, media_type)
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Vary": "Accept"},
+    )
@@ -0,0 +1,90 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from . import budgets
+
+# Заголовок Server-Timing: на что ушло время ответа - SQL запросы (db), ожидание
+# соединения из пула (pool-wait), сериализация (serialize), остальное время
+# приложения (app) и total до начала ответа. Время db берется из счетчика SQL
+# запросов budgets, pool-wait - из пула (pool.py), serialize - из serialization.py.
+# Доля ответов с заголовком - SERVER_TIMING_SAMPLE (0 - выключено, 1 - все)
+SERVER_TIMING_SAMPLE = float(os.getenv("SERVER_TIMING_SAMPLE", "0"))
+
+
+class RequestTiming:
+    """Время компонентов одного HTTP запроса, секунды"""
+
+    def __init__(self):
+        self.pool_wait = 0.0
+        self.serialize = 0.0
+
+
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("current_timing", default=None)
+
+
+def record_pool_wait(seconds: float):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.pool_wait += seconds
+
+
+@contextmanager
+def serializing():
+    """Время внутри блока считается сериализацией ответа"""
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.serialize += time.perf_counter() - start_time
+
+
+def header_value(timing: RequestTiming, total: float) -> bytes:
+    request = budgets.current_request.get()
+    db = request.seconds if request is not None else 0.0
+    queries = request.count if request is not None else 0
+    app = max(0.0, total - db - timing.pool_wait - timing.serialize)
+    return (
+        f'db;dur={db * 1000:.2f};desc="{queries} queries", pool-wait;dur={timing.pool_wait * 1000:.2f}, '
+        f"serialize;dur={timing.serialize * 1000:.2f}, app;dur={app * 1000:.2f}, total;dur={total * 1000:.2f}"
+    ).encode("latin-1")
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: Server-Timing у выбранных по SERVER_TIMING_SAMPLE ответов.
+
+    Должен быть внутри QueryBudgetMiddleware, чтобы видеть счетчик SQL запросов.
+    """
+
+    def __init__(self, app, sample: float = SERVER_TIMING_SAMPLE):
+        self.app = app
+        self.sample = sample
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample < 1 and random.random() >= self.sample):
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start_time
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", header_value(timing, total)),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_timing.reset(token)
@@ -0,0 +1,140 @@
+import os
+import time
+
+from . import metrics
+
+# SLO маршрутов: маршрут объявляет цели декоратором objective - долю запросов
+# быстрее порога (latency) и долю ответов без 5xx (availability). Счетчики
+# хороших и плохих запросов копятся поминутно в памяти процесса, а burn rate
+# (доля плохих / допустимая доля плохих) по нескольким окнам считается при
+# сборе метрик. Burn rate 1 - бюджет ошибок расходуется ровно за период SLO,
+# 14.4 на окнах 1h и 5m - быстрый расход, который стоит будить дежурного.
+SLO_WINDOWS = os.getenv("SLO_WINDOWS", "5m,30m,1h,6h")
+
+_UNITS = {"m": 60, "h": 3600, "d": 86400}
+_BUCKET_SECONDS = 60
+
+
+def _parse_window(window: str) -> int:
+    window = window.strip()
+    if not window or window[-1] not in _UNITS:
+        raise ValueError(f"Unsupported SLO window: {window}")
+    return int(window[:-1]) * _UNITS[window[-1]]
+
+
+WINDOWS = {window.strip(): _parse_window(window) for window in SLO_WINDOWS.split(",") if window.strip()}
+
+
+class Objective:
+    """Цели маршрута: latency секунд для доли latency_target запросов, доля availability без 5xx"""
+
+    def __init__(self, latency: float, latency_target: float, availability: float):
+        self.latency = latency
+        self.latency_target = latency_target
+        self.availability = availability
+
+
+def objective(latency_ms: float, latency_target: float = 0.99, availability: float = 0.999):
+    """Декоратор маршрута: SLO по латентности и доступности"""
+    def decorator(func):
+        func.slo = Objective(latency_ms / 1000, latency_target, availability)
+        return func
+    return decorator
+
+
+class RouteSLO:
+    """Поминутные счетчики запросов маршрута за самое длинное окно"""
+
+    def __init__(self, method: str, template: str, objective: Objective, methods=None):
+        self.method = method
+        # Методы, которыми маршрут обслуживается (у маршрутов Starlette с GET есть и HEAD)
+        self.methods = set(methods or (method,))
+        self.objective = objective
+        self.size = max(WINDOWS.values()) // _BUCKET_SECONDS + 1
+        # Номер минуты и счетчики: всего, медленнее порога, 5xx
+        self._minutes = [-1] * self.size
+        self._total = [0] * self.size
+        self._slow = [0] * self.size
+        self._failed = [0] * self.size
+
+        for sli, target in (("latency", objective.latency_target), ("availability", objective.availability)):
+            metrics.slo_target.labels(method=method, endpoint=template, sli=sli).set(target)
+            for window, seconds in WINDOWS.items():
+                metrics.slo_burn_rate.labels(method=method, endpoint=template, sli=sli, window=window).set_function(
+                    lambda sli=sli, seconds=seconds: self.burn_rate(sli, seconds)
+                )
+        metrics.slo_latency_threshold.labels(method=method, endpoint=template).set(objective.latency)
+
+    def record(self, status: int, duration: float):
+        minute = int(time.monotonic() // _BUCKET_SECONDS)
+        index = minute % self.size
+        if self._minutes[index] != minute:
+            self._minutes[index] = minute
+            self._total[index] = self._slow[index] = self._failed[index] = 0
+        self._total[index] += 1
+        if duration > self.objective.latency:
+            self._slow[index] += 1
+        if status >= 500:
+            self._failed[index] += 1
+
+    def burn_rate(self, sli: str, seconds: int) -> float:
+        # Текущая неполная минута входит в окно
+        now = int(time.monotonic() // _BUCKET_SECONDS)
+        oldest = now - seconds // _BUCKET_SECONDS + 1
+        bad_counts, target = (
+            (self._slow, self.objective.latency_target) if sli == "latency"
+            else (self._failed, self.objective.availability)
+        )
+        total = bad = 0
+        for index, minute in enumerate(self._minutes):
+            if oldest <= minute <= now:
+                total += self._total[index]
+                bad += bad_counts[index]
+        if total == 0:
+            return 0.0
+        return (bad / total) / (1 - target)
+
+
+class SLOMiddleware:
+    """ASGI middleware: учет запросов маршрутов с SLO"""
+
+    def __init__(self, app, routes):
+        self.app = app
+        # Как и в RequestMetricsMiddleware, маршруты читаются при первом запросе
+        self.routes = routes
+        self._trackers = None
+
+    def _bind_trackers(self):
+        self._trackers = {}
+        for route in self.routes:
+            endpoint = getattr(route, "endpoint", None)
+            objective = getattr(endpoint, "slo", None)
+            if objective is not None:
+                # У маршрутов FastAPI один метод (GET добавляет HEAD)
+                method = sorted(route.methods - {"HEAD"})[0]
+                self._trackers[endpoint] = RouteSLO(method, route.path_format, objective, route.methods)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._trackers is None:
+            self._bind_trackers()
+
+        start_time = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            tracker = self._trackers.get(scope.get("endpoint"))
+            # Starlette кладет endpoint в scope и при совпадении только пути (405):
+            # запросы другим методом не относятся к SLO маршрута
+            if tracker is not None and scope["method"] in tracker.methods:
+                tracker.record(status, time.perf_counter() - start_time)
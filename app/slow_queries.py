@@ -0,0 +1,177 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from . import budgets, metrics, route_classes, tracing
+
+# Журнал медленных SQL запросов: запрос дольше SLOW_QUERY_THRESHOLD_MS попадает в
+# кольцевой буфер (GET /admin/slow-queries) и в JSONL файл с отпечатком, операцией,
+# маршрутом и параметрами без значений строк. Для части запросов фоновый поток
+# снимает план EXPLAIN с теми же параметрами; запрос клиента его не ждет.
+# Отрицательный порог выключает журнал
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500"))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "200"))
+# Пусто - только кольцевой буфер
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "")
+# Доля медленных запросов, для которых снимается план, и не чаще раза в
+# SLOW_QUERY_EXPLAIN_INTERVAL секунд на отпечаток
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.1"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+# ANALYZE выполняет запрос еще раз (только SELECT, в READ ONLY транзакции с откатом)
+SLOW_QUERY_EXPLAIN_ANALYZE = os.getenv("SLOW_QUERY_EXPLAIN_ANALYZE", "false").lower() == "true"
+SLOW_QUERY_EXPLAIN_BUFFERS = os.getenv("SLOW_QUERY_EXPLAIN_BUFFERS", "false").lower() == "true"
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+
+THRESHOLD = SLOW_QUERY_THRESHOLD_MS / 1000 if SLOW_QUERY_THRESHOLD_MS >= 0 else float("inf")
+# Запросы самого EXPLAIN в журнал не попадают
+EXPLAIN_OPERATION = "slow_query_explain"
+_STATEMENT_MAX = 4000
+_QUEUE_MAX = 1000
+
+SET_EXPLAIN_TIMEOUT_SQL = text("SELECT set_config('statement_timeout', :timeout, true)")
+
+
+def redact(parameters):
+    """Числа, bool и None остаются, остальные значения заменяются типом и длиной"""
+    if isinstance(parameters, dict):
+        return {name: redact(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None or isinstance(parameters, (bool, int, float)):
+        return parameters
+    if isinstance(parameters, (str, bytes)):
+        return f"<{type(parameters).__name__}:{len(parameters)}>"
+    return f"<{type(parameters).__name__}>"
+
+
+def _explain_options(statement: str) -> str:
+    options = ["FORMAT JSON"]
+    if SLOW_QUERY_EXPLAIN_ANALYZE and statement.split(None, 1)[0].upper() in ("SELECT", "WITH"):
+        options.append("ANALYZE")
+        if SLOW_QUERY_EXPLAIN_BUFFERS:
+            options.append("BUFFERS")
+    return ", ".join(options)
+
+
+class SlowQueryLog:
+    """Кольцевой буфер медленных запросов и поток, который снимает планы и пишет файл"""
+
+    def __init__(self, size: int = SLOW_QUERY_BUFFER_SIZE, path: str = SLOW_QUERY_LOG_FILE):
+        self.path = path
+        self._entries = deque(maxlen=size)
+        self._queue = queue.Queue(maxsize=_QUEUE_MAX)
+        self._explained_at = {}
+        self._thread = None
+
+    def record(self, statement: str, parameters, executemany: bool, duration: float,
+               fingerprint: str, operation: str, error: str = None):
+        """Вызывается из queries.py для запроса дольше THRESHOLD"""
+        if operation == EXPLAIN_OPERATION:
+            return
+        if executemany:
+            # Для плана достаточно первого набора параметров
+            rows, parameters = len(parameters), parameters[0] if parameters else None
+        else:
+            rows = 1
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 2),
+            "fingerprint": fingerprint,
+            "operation": operation,
+            "route": budgets.current_route(),
+            "trace_id": tracing.current_trace_id(),
+            "statement": statement[:_STATEMENT_MAX],
+            "parameters": redact(parameters),
+            "executemany": rows if executemany else None,
+            "error": error,
+            # Заполняется фоновым потоком; ключ есть заранее, чтобы словарь не менял размер
+            "plan": None,
+        }
+        self._entries.append(entry)
+        metrics.slow_queries_total.labels(operation=operation).inc()
+
+        explain = error is None and self._should_explain(fingerprint)
+        try:
+            self._queue.put_nowait((entry, statement, parameters if explain else None, explain))
+        except queue.Full:
+            metrics.slow_query_log_dropped_total.inc()
+
+    def _should_explain(self, fingerprint: str) -> bool:
+        if SLOW_QUERY_EXPLAIN_SAMPLE <= 0 or random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE:
+            return False
+        now = time.monotonic()
+        explained_at = self._explained_at.get(fingerprint)
+        if explained_at is not None and now - explained_at < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        self._explained_at[fingerprint] = now
+        return True
+
+    def entries(self, limit: int) -> list:
+        """Последние записи, новые первыми"""
+        entries = list(self._entries)
+        entries.reverse()
+        return entries[:limit]
+
+    def explain(self, statement: str, parameters) -> list:
+        # Импорт внутри функции: database импортирует queries, а queries - этот модуль
+        from .database import engines
+
+        # Пул admin, чтобы план не занимал соединения пулов, на которых медленно
+        engine = engines[route_classes.ADMIN].execution_options(postgresql_readonly=True)
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                connection.execute(SET_EXPLAIN_TIMEOUT_SQL, {"timeout": str(SLOW_QUERY_EXPLAIN_TIMEOUT_MS)})
+                plan = connection.exec_driver_sql(
+                    f"EXPLAIN ({_explain_options(statement)}) {statement}", parameters or None
+                ).scalar()
+                # ANALYZE выполнил запрос: ничего не сохраняем
+                transaction.rollback()
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def _process(self, entry: dict, statement: str, parameters, explain: bool):
+        if explain:
+            try:
+                entry["plan"] = self.explain(statement, parameters)
+                metrics.slow_query_explains_total.labels(outcome="captured").inc()
+            except Exception as e:
+                entry["plan"] = {"error": str(e).splitlines()[0]}
+                metrics.slow_query_explains_total.labels(outcome="failed").inc()
+        if self.path:
+            try:
+                with open(self.path, "a", encoding="utf-8") as log_file:
+                    log_file.write(json.dumps(entry, default=str) + "\n")
+            except OSError as e:
+                print(f"Error writing slow query log: {e}")
+
+    def _run(self):
+        # Импорт внутри функции: queries импортирует этот модуль
+        from . import queries
+
+        queries.current_operation.set(EXPLAIN_OPERATION)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._process(*item)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Дописывает уже поставленные в очередь записи и останавливает поток"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+log = SlowQueryLog()
@@ -0,0 +1,335 @@
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.middleware import Middleware
+
+from . import metrics
+
+# Трассировка запросов: корневой span HTTP запроса, span на каждый слой middleware,
+# на функции crud/reads (queries.tracked), на ожидание соединения из пула и на
+# каждый SQL запрос. Контекст приходит в заголовке W3C traceparent.
+# Спаны пишутся для всех запросов, а решение о сохранении принимается в конце:
+# выбран при старте (TRACE_SAMPLE или флаг sampled в traceparent), дольше
+# TRACE_SLOW_MS или ответ 5xx. Сохраненные трассы экспортируются фоновым потоком
+# в формате OTLP/JSON - в JSONL файл или POST на OTLP/HTTP коллектор.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0.01"))
+# Отрицательное значение - без хвостового сэмплирования по латентности
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl").lower()
+if TRACE_EXPORTER not in ("jsonl", "otlp"):
+    raise ValueError(f"Unsupported TRACE_EXPORTER: {TRACE_EXPORTER}")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+
+SERVICE_NAME = "learntracker"
+TRACEPARENT_HEADER = b"traceparent"
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_EXPORT_BATCH = 100
+_EXPORT_INTERVAL = 1.0
+_QUEUE_MAX = 1000
+
+# Значения SpanKind и StatusCode OTLP
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+STATUS_ERROR = 2
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, span_id: str, parent_id: Optional[str], kind: int, attributes: dict):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def end(self):
+        self.end_ns = time.time_ns()
+
+
+class Trace:
+    """Спаны одного HTTP запроса"""
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.dropped = 0
+
+    def start(self, name: str, kind: int = INTERNAL, attributes: Optional[dict] = None,
+              parent_id: Optional[str] = None) -> Span:
+        if parent_id is None:
+            parent = current_span.get()
+            parent_id = parent.span_id if parent is not None else None
+        span = Span(name, f"{random.getrandbits(64):016x}", parent_id, kind, attributes or {})
+        # Лимит защищает память от запросов с тысячами SQL запросов
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+        return span
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def start_span(name: str, kind: int = INTERNAL, attributes: Optional[dict] = None) -> Optional[Span]:
+    """Span без смены текущего (SQL запрос); None - запрос не трассируется"""
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    return trace.start(name, kind, attributes)
+
+
+@contextmanager
+def span(name: str, kind: int = INTERNAL, attributes: Optional[dict] = None):
+    """Span вокруг блока; вложенные спаны становятся его детьми"""
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start(name, kind, attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current_span.reset(token)
+        current.end()
+
+
+def parse_traceparent(value: Optional[bytes]):
+    """(trace_id, parent_span_id, sampled) из заголовка traceparent или None"""
+    if value is None:
+        return None
+    match = _TRACEPARENT.match(value.decode("latin-1").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def encode(traces: list) -> dict:
+    """OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for trace in traces:
+        for item in trace.spans:
+            encoded = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": item.kind,
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns or item.start_ns),
+                "attributes": [_attribute(key, value) for key, value in item.attributes.items()],
+            }
+            if item.parent_id is not None:
+                encoded["parentSpanId"] = item.parent_id
+            if item.error is not None:
+                encoded["status"] = {"code": STATUS_ERROR, "message": item.error}
+            spans.append(encoded)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": f"{SERVICE_NAME}.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class TraceExporter:
+    """Очередь сохраненных трасс и поток, который отправляет их пачками"""
+
+    def __init__(self, exporter: str = TRACE_EXPORTER):
+        self.exporter = exporter
+        self._queue = queue.Queue(maxsize=_QUEUE_MAX)
+        self._thread = None
+
+    def submit(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            metrics.traces_total.labels(decision="export_dropped").inc()
+
+    def _write(self, traces: list):
+        payload = json.dumps(encode(traces), separators=(",", ":"))
+        if self.exporter == "jsonl":
+            with open(TRACE_FILE, "a", encoding="utf-8") as trace_file:
+                trace_file.write(payload + "\n")
+            return
+        request = urllib.request.Request(
+            TRACE_OTLP_ENDPOINT, data=payload.encode(), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    def export(self, traces: list):
+        try:
+            self._write(traces)
+        except Exception as e:
+            metrics.trace_export_failures_total.inc()
+            print(f"Trace export of {len(traces)} traces failed: {e}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = [] if item is None else [item]
+            stopping = item is None
+            deadline = time.monotonic() + _EXPORT_INTERVAL
+            while not stopping and len(batch) < _EXPORT_BATCH:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                self.export(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Отправляет накопленные трассы и останавливает поток"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+exporter = TraceExporter()
+
+
+class TracingMiddleware:
+    """ASGI middleware: корневой span запроса и решение, сохранять ли трассу.
+
+    Стоит внутри RequestMetricsMiddleware: id сохраненной трассы кладется в
+    scope["trace_id"], и RequestMetricsMiddleware добавляет его как exemplar.
+    """
+
+    def __init__(self, app, sample: float = TRACE_SAMPLE, slow_ms: float = TRACE_SLOW_MS):
+        self.app = app
+        self.sample = sample
+        self.slow = slow_ms / 1000 if slow_ms >= 0 else float("inf")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = parse_traceparent(next((v for k, v in scope["headers"] if k == TRACEPARENT_HEADER), None))
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = f"{random.getrandbits(128):032x}", None, random.random() < self.sample
+        trace = Trace(trace_id, sampled)
+        root = trace.start(f"{scope['method']} {scope['path']}", SERVER, {"http.method": scope["method"]}, parent_id)
+        trace_token = current_trace.set(trace)
+        span_token = current_span.set(root)
+        start_time = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            current_span.reset(span_token)
+            current_trace.reset(trace_token)
+            root.end()
+            route = scope.get("route")
+            template = getattr(route, "path_format", None)
+            if template is not None:
+                root.name = f"{scope['method']} {template}"
+                root.attributes["http.route"] = template
+            root.attributes["http.target"] = scope["path"]
+            root.attributes["http.status_code"] = status
+            if status >= 500 and root.error is None:
+                root.error = f"HTTP {status}"
+            if trace.dropped:
+                root.attributes["trace.dropped_spans"] = trace.dropped
+            self._finish(scope, trace, status, time.perf_counter() - start_time)
+
+    def _finish(self, scope, trace: Trace, status: int, duration: float):
+        if trace.sampled:
+            decision = "head"
+        elif status >= 500:
+            decision = "error"
+        elif duration >= self.slow:
+            decision = "slow"
+        else:
+            metrics.traces_total.labels(decision="discarded").inc()
+            return
+        metrics.traces_total.labels(decision=decision).inc()
+        scope["trace_id"] = trace.trace_id
+        exporter.submit(trace)
+
+
+class MiddlewareSpan:
+    """Span вокруг слоя middleware (оборачивается в instrument_middleware)"""
+
+    def __init__(self, app, middleware, **options):
+        self.name = f"middleware.{middleware.__name__}"
+        self.app = middleware(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or current_trace.get() is None:
+            await self.app(scope, receive, send)
+            return
+        with span(self.name):
+            await self.app(scope, receive, send)
+
+
+def instrument_middleware(app):
+    """Оборачивает уже добавленные middleware в спаны (вызывать до add_middleware(TracingMiddleware))"""
+    app.user_middleware = [
+        Middleware(MiddlewareSpan, middleware=item.cls, **item.options) for item in app.user_middleware
+    ]
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics, models, queries, route_classes
+from .database import SessionLocal, engines
+
+# Write-behind: события (прохождения уроков, решения) копятся в ограниченном
+# буфере в памяти и пишутся пачкой INSERT ... ON CONFLICT DO NOTHING по размеру
+# пачки или по таймеру. При падении процесса теряется не больше одного интервала
+# сброса, поэтому режим включается явно.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_MAX_SIZE = int(os.getenv("WRITE_BEHIND_MAX_SIZE", "10000"))
+WRITE_BEHIND_FLUSH_SIZE = int(os.getenv("WRITE_BEHIND_FLUSH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+
+
+class WriteBehindBuffer:
+    """Буфер строк одной таблицы и поток, который сбрасывает их в БД"""
+
+    def __init__(self, table, max_size: int = WRITE_BEHIND_MAX_SIZE,
+                 flush_size: int = WRITE_BEHIND_FLUSH_SIZE, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL):
+        self.table = table
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+        self._depth_gauge = metrics.write_behind_depth.labels(table=table.name)
+        self._flush_histogram = metrics.write_behind_flush_seconds.labels(table=table.name)
+        self._flushed_counter = metrics.write_behind_flushed_total.labels(table=table.name)
+
+    def offer(self, row: dict) -> bool:
+        """Кладет строку в буфер; False - буфер переполнен и событие отброшено"""
+        with self._condition:
+            if len(self._rows) >= self.max_size:
+                metrics.write_behind_dropped_total.labels(table=self.table.name, reason="buffer_full").inc()
+                return False
+            self._rows.append(row)
+            self._depth_gauge.set(len(self._rows))
+            if len(self._rows) >= self.flush_size:
+                self._condition.notify()
+        return True
+
+    def _take(self) -> list:
+        with self._condition:
+            if not self._stopping and len(self._rows) < self.flush_size:
+                self._condition.wait(self.flush_interval)
+            rows, self._rows = self._rows[:self.flush_size], self._rows[self.flush_size:]
+            self._depth_gauge.set(len(self._rows))
+            return rows
+
+    def flush(self, rows: list):
+        start_time = time.perf_counter()
+        statement = insert(self.table).on_conflict_do_nothing()
+        db = SessionLocal(bind=engines[route_classes.WRITE])
+        rejected = 0
+        try:
+            try:
+                db.execute(statement, rows)
+                db.commit()
+            except IntegrityError:
+                # Например, ссылка на несуществующего студента: повторяем построчно,
+                # отбрасывая только строки, которые БД не принимает
+                db.rollback()
+                for row in rows:
+                    try:
+                        with db.begin_nested():
+                            db.execute(statement, row)
+                    except IntegrityError:
+                        rejected += 1
+                db.commit()
+        except Exception as e:
+            print(f"Write-behind flush of {len(rows)} rows into {self.table.name} failed: {e}")
+            self._requeue(rows)
+            return
+        finally:
+            db.close()
+        if rejected:
+            metrics.write_behind_dropped_total.labels(table=self.table.name, reason="rejected").inc(rejected)
+        self._flushed_counter.inc(len(rows) - rejected)
+        self._flush_histogram.observe(time.perf_counter() - start_time)
+
+    def _requeue(self, rows: list):
+        # БД недоступна: возвращаем строки в начало буфера и ждем интервал сброса.
+        # При остановке повторять некому - такие строки теряются
+        with self._condition:
+            free = 0 if self._stopping else max(0, self.max_size - len(self._rows))
+            self._rows[:0] = rows[:free]
+            self._depth_gauge.set(len(self._rows))
+            if len(rows) > free:
+                metrics.write_behind_dropped_total.labels(
+                    table=self.table.name, reason="flush_error"
+                ).inc(len(rows) - free)
+            stopping = self._stopping
+        if not stopping:
+            time.sleep(self.flush_interval)
+
+    def _run(self):
+        queries.current_operation.set(f"write_behind_{self.table.name}")
+        while True:
+            rows = self._take()
+            if rows:
+                self.flush(rows)
+            with self._condition:
+                if self._stopping and not self._rows:
+                    return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.table.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Сбрасывает весь буфер в БД и останавливает поток"""
+        if self._thread is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+
+
+lesson_completions = WriteBehindBuffer(models.LessonCompletion.__table__)
+submissions = WriteBehindBuffer(models.Submission.__table__)
+buffers = (lesson_completions, submissions)
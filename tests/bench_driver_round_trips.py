@@ -0,0 +1,160 @@
+"""Round trips и латентность запросов к API для драйвера DB_DRIVER.
+
+Нужен Postgres (POSTGRES_HOST/POSTGRES_PORT) с хотя бы одним уроком. Запуск из
+корня репозитория, по разу на драйвер:
+
+    DB_DRIVER=psycopg2 RTT_MS=2 python -m tests.bench_driver_round_trips
+    DB_DRIVER=psycopg RTT_MS=2 python -m tests.bench_driver_round_trips
+    DB_DRIVER=psycopg DB_PREPARE_THRESHOLD=none RTT_MS=0 python -m tests.bench_driver_round_trips
+
+При RTT_MS > 0 соединения к БД идут через TCP прокси, который задерживает
+каждое направление на RTT_MS/2 и считает round trips (ответ сервера после
+данных клиента). Пишет в БД: создает студентов и отправки.
+"""
+import os
+import queue
+import socket
+import statistics
+import threading
+import time
+
+RTT_MS = float(os.getenv("RTT_MS", "2"))
+PROXY_PORT = int(os.getenv("PROXY_PORT", "6432"))
+TARGET = (os.getenv("POSTGRES_HOST", "localhost"), int(os.getenv("POSTGRES_PORT", "5432")))
+
+
+class LatencyProxy:
+    """TCP прокси с задержкой и счетчиком round trips"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.round_trips = 0
+        self._last_direction = None
+        self._lock = threading.Lock()
+
+    def _pipe(self, source, destination, from_client: bool):
+        pending = queue.Queue()
+
+        def writer():
+            while True:
+                received_at, data = pending.get()
+                if data is None:
+                    break
+                wait = received_at + self.delay - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    destination.sendall(data)
+                except OSError:
+                    break
+            try:
+                destination.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+        threading.Thread(target=writer, daemon=True).start()
+        while True:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                data = b""
+            if data:
+                with self._lock:
+                    if not from_client and self._last_direction == "client":
+                        self.round_trips += 1
+                    self._last_direction = "client" if from_client else "server"
+            pending.put((time.perf_counter(), data or None))
+            if not data:
+                break
+
+    def _serve(self, listener):
+        while True:
+            client, _ = listener.accept()
+            server = socket.create_connection(TARGET)
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._pipe, args=(client, server, True), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(server, client, False), daemon=True).start()
+
+    def start(self, port: int):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", port))
+        listener.listen(100)
+        threading.Thread(target=self._serve, args=(listener,), daemon=True).start()
+
+
+proxy = None
+if RTT_MS > 0:
+    proxy = LatencyProxy(RTT_MS / 2000)
+    proxy.start(PROXY_PORT)
+    # До импорта app: адрес БД читается при импорте database.py
+    os.environ["POSTGRES_HOST"] = "127.0.0.1"
+    os.environ["POSTGRES_PORT"] = str(PROXY_PORT)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+from app import crud, models  # noqa: E402
+from app.database import DB_DRIVER, DB_PREPARE_THRESHOLD, SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def run(name: str, request, count: int):
+    latencies = []
+    round_trips = proxy.round_trips if proxy else 0
+    for i in range(count):
+        start_time = time.perf_counter()
+        response = request(i)
+        latencies.append(time.perf_counter() - start_time)
+        if not response.is_success:
+            raise SystemExit(f"{name}: {response.status_code} {response.text}")
+    per_request = f"{(proxy.round_trips - round_trips) / count:5.2f}" if proxy else "    -"
+    print(f"{DB_DRIVER:9} rtt={RTT_MS:g}ms {name:16} round_trips/req={per_request} "
+          f"p50={statistics.median(latencies) * 1000:7.2f}ms")
+
+
+def hot_lookups(student_id: int, course_id: int, rounds: int = 15):
+    """400 get_course + get_student в одной сессии (prepared statements psycopg 3)"""
+    latencies = []
+    for _ in range(rounds):
+        db = SessionLocal()
+        try:
+            start_time = time.perf_counter()
+            for _ in range(200):
+                crud.get_course(db, course_id)
+                crud.get_student(db, student_id)
+                db.expunge_all()
+            latencies.append(time.perf_counter() - start_time)
+        finally:
+            db.close()
+    print(f"{DB_DRIVER:9} rtt={RTT_MS:g}ms 400 hot lookups   prepare_threshold={DB_PREPARE_THRESHOLD:4} "
+          f"p50={statistics.median(latencies) * 1000:7.2f}ms")
+
+
+def main():
+    with SessionLocal() as db:
+        student_id = db.scalar(select(func.min(models.Student.id)))
+        course_id = db.scalar(select(func.min(models.Course.id)))
+        lesson_id = db.scalar(select(func.min(models.Lesson.id)))
+    if None in (student_id, course_id, lesson_id):
+        raise SystemExit("Нужны студент, курс и урок в БД")
+
+    stamp = time.time()
+    with TestClient(app) as client:
+        # Прогрев пулов и кешей
+        client.get(f"/api/v1/courses/{course_id}")
+        client.post("/api/v1/students", json={"name": "bench", "email": f"warmup-{stamp}@example.com"})
+
+        run("GET course", lambda i: client.get(f"/api/v1/courses/{course_id}"), 300)
+        run("POST student", lambda i: client.post(
+            "/api/v1/students", json={"name": "bench", "email": f"bench-{stamp}-{i}@example.com"}
+        ), 200)
+        run("POST submission", lambda i: client.post(
+            "/api/v1/submissions", json={"student_id": student_id, "lesson_id": lesson_id, "content": "bench"}
+        ), 200)
+    hot_lookups(student_id, course_id)
+
+
+if __name__ == "__main__":
+    main()
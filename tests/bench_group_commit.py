@@ -0,0 +1,88 @@
+"""Записи в секунду: отдельный коммит на запись против GroupCommitWriter.
+
+Нужен Postgres со студентом и уроком. Запуск из корня репозитория (окно и размер
+пачки - как в приложении, GROUP_COMMIT_WINDOW_MS / GROUP_COMMIT_MAX_BATCH):
+
+    python -m tests.bench_group_commit              # оба режима
+    GROUP_COMMIT_WINDOW_MS=2 python -m tests.bench_group_commit group
+
+Каждый режим - 1, 10 и 100 потоков-писателей по DURATION секунд; запись -
+create_submission (direct) или crud.add_submission через группу (group).
+Пишет в БД отправки.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from app import crud, group_commit, models, schemas
+from app.database import SessionLocal, engines
+
+DURATION = float(os.getenv("DURATION", "4"))
+WRITERS = (1, 10, 100)
+MODES = ("direct", "group")
+
+
+def direct(submission):
+    db = SessionLocal(bind=engines["write"])
+    try:
+        crud.create_submission(db, submission)
+    finally:
+        db.close()
+
+
+def run(mode: str, write, writers: int):
+    counts = [0] * writers
+    latencies = []
+    stop_at = time.perf_counter() + DURATION
+
+    def worker(index):
+        while time.perf_counter() < stop_at:
+            start_time = time.perf_counter()
+            write()
+            latencies.append(time.perf_counter() - start_time)
+            counts[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+    latencies.sort()
+    print(f"{mode:6} window={group_commit.GROUP_COMMIT_WINDOW_MS:g}ms writers={writers:3} "
+          f"writes/sec={sum(counts) / elapsed:7.0f} p50={statistics.median(latencies) * 1000:6.2f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1000:7.2f}ms")
+
+
+def main():
+    modes = sys.argv[1:] or MODES
+    if set(modes) - set(MODES):
+        raise SystemExit(f"Режимы: {', '.join(MODES)}")
+    with SessionLocal() as db:
+        student_id = db.scalar(select(func.min(models.Student.id)))
+        lesson_id = db.scalar(select(func.min(models.Lesson.id)))
+    if student_id is None or lesson_id is None:
+        raise SystemExit("Нужны студент и урок в БД")
+    submission = schemas.SubmissionCreate(student_id=student_id, lesson_id=lesson_id, content="bench")
+
+    for mode in modes:
+        if mode == "direct":
+            for writers in WRITERS:
+                run(mode, lambda: direct(submission), writers)
+            continue
+        writer = group_commit.GroupCommitWriter()
+        writer.start()
+        try:
+            for writers in WRITERS:
+                run(mode, lambda: writer.submit_nowait(crud.add_submission, submission).result(), writers)
+        finally:
+            writer.stop()
+
+
+if __name__ == "__main__":
+    main()
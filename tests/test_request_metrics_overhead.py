@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+from fastapi import FastAPI, Response
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app import metrics
+
+# Накладные расходы RequestMetricsMiddleware: простой маршрут FastAPI вызывается
+# напрямую через ASGI (без HTTP клиента) без middleware, с пустым
+# BaseHTTPMiddleware (как бывший @app.middleware("http")) и с RequestMetricsMiddleware.
+# Результат в мкс на запрос печатается; запустить: python -m pytest -s tests
+REQUESTS = 2000
+ROUNDS = 3
+TEMPLATE = "/bench/items/{item_id}"
+
+
+def make_app(kind: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get(TEMPLATE)
+    async def item(item_id: int):
+        return Response(b"ok")
+
+    if kind == "base":
+        async def dispatch(request, call_next):
+            return await call_next(request)
+        app.add_middleware(BaseHTTPMiddleware, dispatch=dispatch)
+    elif kind == "metrics":
+        app.add_middleware(metrics.RequestMetricsMiddleware, routes=app.routes)
+    return app
+
+
+async def call(app, method: str, path: str) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [], "client": ("127.0.0.1", 1), "server": ("test", 80),
+    }
+    body_sent = False
+    status = None
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Клиент не отключается до конца ответа
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def microseconds_per_request(kind: str) -> float:
+    app = make_app(kind)
+    for i in range(200):
+        await call(app, "GET", f"/bench/items/{i}")
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start_time = time.perf_counter()
+        for i in range(REQUESTS):
+            await call(app, "GET", f"/bench/items/{i % 1000}")
+        best = min(best, (time.perf_counter() - start_time) / REQUESTS * 1e6)
+    return best
+
+
+def test_overhead(capsys):
+    results = {kind: asyncio.run(microseconds_per_request(kind)) for kind in ("none", "base", "metrics")}
+    with capsys.disabled():
+        print()
+        for kind, value in results.items():
+            print(f"{kind:8s} {value:7.1f} us/request, overhead {value - results['none']:6.1f} us")
+    # Порядок величин: BaseHTTPMiddleware - сотни мкс, ASGI middleware - единицы-десятки
+    assert results["metrics"] - results["none"] < results["base"] - results["none"]
+
+
+def sample(method: str, endpoint: str, status: int) -> float:
+    value = metrics.REGISTRY.get_sample_value(
+        "learntracker_http_requests_total", {"method": method, "endpoint": endpoint, "status": str(status)}
+    )
+    return value or 0.0
+
+
+def endpoint_labels() -> set:
+    return {
+        s.labels["endpoint"]
+        for family in metrics.REGISTRY.collect() if family.name == "learntracker_http_requests"
+        for s in family.samples
+    }
+
+
+def test_labels():
+    app = make_app("metrics")
+    before = {
+        "template": sample("GET", TEMPLATE, 200),
+        "unmatched": sample("GET", metrics.UNMATCHED_ENDPOINT, 404),
+        "other": sample("OTHER", metrics.UNMATCHED_ENDPOINT, 404),
+    }
+
+    async def requests():
+        for i in range(3):
+            assert await call(app, "GET", f"/bench/items/{i}") == 200
+        assert await call(app, "GET", "/bench/missing/1") == 404
+        assert await call(app, "GET", "/bench/missing/2") == 404
+        assert await call(app, "BREW", "/bench/missing/3") == 404
+
+    asyncio.run(requests())
+
+    assert sample("GET", TEMPLATE, 200) - before["template"] == 3
+    assert sample("GET", metrics.UNMATCHED_ENDPOINT, 404) - before["unmatched"] == 2
+    assert sample("OTHER", metrics.UNMATCHED_ENDPOINT, 404) - before["other"] == 1
+    # Пути запросов в метку не попадают
+    labels = endpoint_labels()
+    assert not {"/bench/items/0", "/bench/missing/1", "/bench/missing/3"} & labels
+    assert TEMPLATE in labels
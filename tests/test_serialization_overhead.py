@@ -0,0 +1,64 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app import models, schemas, serialization
+
+# Сериализация страницы из 100 Submission: путь FastAPI по умолчанию
+# (response_model с from_attributes + JSONResponse) против serialization.py
+# (закешированный TypeAdapter сразу в байты). Печатает мкс и страниц в секунду
+# на ядро; запустить: python -m pytest -s tests
+PAGES = 1000
+ROUNDS = 3
+
+
+def submissions(count: int = 100) -> list:
+    now = datetime.now(timezone.utc)
+    return [
+        models.Submission(id=i, student_id=i, lesson_id=i, content="x" * 80, status="pending", submitted_at=now)
+        for i in range(count)
+    ]
+
+
+def fastapi_body(loop, field, rows) -> bytes:
+    content = loop.run_until_complete(serialize_response(field=field, response_content=rows, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def best_seconds_per_page(render) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start_time = time.perf_counter()
+        for _ in range(PAGES):
+            render()
+        best = min(best, (time.perf_counter() - start_time) / PAGES)
+    return best
+
+
+def test_serialization_overhead(capsys):
+    rows = submissions()
+    field = create_response_field(name="response", type_=List[schemas.Submission])
+    loop = asyncio.new_event_loop()
+    try:
+        expected = fastapi_body(loop, field, rows)
+        # Тот же JSON, что и у response_model
+        assert json.loads(serialization.json_list_response(schemas.Submission, rows).body) == json.loads(expected)
+
+        results = {
+            "fastapi": best_seconds_per_page(lambda: fastapi_body(loop, field, rows)),
+            "direct": best_seconds_per_page(lambda: serialization.json_list_response(schemas.Submission, rows)),
+        }
+    finally:
+        loop.close()
+
+    with capsys.disabled():
+        print()
+        for kind, seconds in results.items():
+            print(f"{kind:8s} {seconds * 1e6:7.0f} us/page, {1 / seconds:6.0f} pages/s per core")
+    assert results["direct"] < results["fastapi"]